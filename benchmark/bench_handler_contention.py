@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+    Handler lock contention benchmark
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Logs records with tracebacks from an increasing number of threads into
+    a file handler and reports the throughput for each thread count.  Use
+    this to see how much of the handler work is serialized on the handler
+    lock.
+
+    Usage::
+
+        python benchmark/bench_handler_contention.py [records_per_thread]
+
+    :copyright: (c) 2010 by Armin Ronacher, Georg Brandl.
+    :license: BSD, see LICENSE for more details.
+"""
+from __future__ import with_statement
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+from threading import Thread
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from logbook import Logger, FileHandler, RotatingFileHandler
+
+
+THREAD_COUNTS = [1, 2, 4, 8, 16]
+
+
+def log_records(logger, count):
+    for x in xrange(count):
+        try:
+            1/0
+        except Exception:
+            logger.exception('Record {0} failed', x)
+
+
+def run(handler_factory, threads, count):
+    logger = Logger('Contention')
+    handler = handler_factory()
+    workers = [Thread(target=log_records, args=(logger, count))
+               for x in xrange(threads)]
+    with handler.applicationbound():
+        start = time.time()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        duration = time.time() - start
+    handler.close()
+    return (threads * count) / duration
+
+
+def main():
+    count = 2000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    dirname = tempfile.mkdtemp()
+    filename = os.path.join(dirname, 'bench.log')
+    factories = [
+        ('FileHandler', lambda: FileHandler(filename)),
+        ('RotatingFileHandler', lambda: RotatingFileHandler(
+            filename, max_size=16 * 1024 * 1024, backup_count=2)),
+    ]
+    try:
+        for name, factory in factories:
+            print name
+            for threads in THREAD_COUNTS:
+                rate = run(factory, threads, count)
+                print '  %3d threads: %10.0f records/sec' % (threads, rate)
+    finally:
+        shutil.rmtree(dirname)
+
+
+if __name__ == '__main__':
+    main()
@@ -10,14 +10,15 @@
     :license: BSD, see LICENSE for more details.
 """
 
-from logbook.base import LogRecord, Logger, LoggerGroup, NestedSetup, \
-     Processor, get_level_name, lookup_level, dispatch_record, CRITICAL, \
-     ERROR, WARNING, NOTICE, INFO, DEBUG, NOTSET
+from logbook.base import LogRecord, FrozenRecord, Logger, LoggerGroup, \
+     NestedSetup, Processor, get_level_name, lookup_level, dispatch_record, \
+     dispatch_records, CRITICAL, ERROR, WARNING, NOTICE, INFO, DEBUG, NOTSET
 from logbook.handlers import Handler, StreamHandler, FileHandler, \
      MonitoringFileHandler, StderrHandler, RotatingFileHandler, \
-     TimedRotatingFileHandler, TestHandler, MailHandler, SyslogHandler, \
-     NullHandler, NTEventLogHandler, create_syshandler, StringFormatter, \
-     StringFormatterHandlerMixin, HashingHandlerMixin, LimitingHandlerMixin
+     TimedRotatingFileHandler, SharedRotatingFileHandler, TestHandler, \
+     MailHandler, SyslogHandler, NullHandler, NTEventLogHandler, \
+     create_syshandler, StringFormatter, StringFormatterHandlerMixin, \
+     HashingHandlerMixin, LimitingHandlerMixin
 
 
 # create an anonymous default logger and provide all important
@@ -17,7 +17,7 @@ import threading
 import traceback
 from thread import get_ident as current_thread
 from contextlib import contextmanager
-from itertools import count, chain
+from itertools import count, chain, izip
 from weakref import ref as weakref
 from datetime import datetime
 
@@ -327,6 +327,13 @@ def _create_log_record(cls, dict):
     return cls.from_dict(dict)
 
 
+def _create_frozen_record(cls, values):
+    """Like :func:`_create_log_record` but for frozen records."""
+    rv = object.__new__(cls)
+    rv.__dict__.update(izip(cls._fields, values))
+    return rv
+
+
 class LogRecord(object):
     """A LogRecord instance represents an event being logged.
 
@@ -630,6 +637,98 @@ class LogRecord(object):
             return self._dispatcher()
 
 
+class FrozenRecord(LogRecord):
+    """An immutable snapshot of a log record that is safe to hand over to
+    other threads and processes.  It is created with :meth:`from_record`
+    while the original record is still open, from then on it does not
+    depend on interpreter frames, tracebacks or the thread that created
+    it.  The message is formatted already, so :attr:`msg` and
+    :attr:`message` are the same and there are no arguments.
+
+    Frozen records pickle into a plain tuple of their values which is a
+    lot cheaper than the dictionary based pickling of regular records.
+    Apart from :attr:`keep_open` and :attr:`late` attributes cannot be
+    changed and closing a frozen record does nothing.
+    """
+    _fields = ('channel', 'level', 'msg', 'time', 'process', 'process_name',
+               'thread', 'thread_name', 'filename', 'lineno', 'func_name',
+               'module', 'formatted_exception', 'exception_name',
+               'exception_message', 'extra')
+    _mutable_attrs = frozenset(['keep_open', 'late'])
+
+    args = ()
+    kwargs = {}
+    exc_info = None
+    frame = None
+    calling_frame = None
+    _dispatcher = None
+    heavy_initialized = True
+    information_pulled = True
+    late = True
+
+    def __init__(self, *args, **kwargs):
+        raise TypeError('frozen records are created with from_record()')
+
+    @classmethod
+    def from_record(cls, record, safe_extra=False):
+        """Creates a frozen record from a log record.  If the record is a
+        frozen record already it is returned unchanged.  If `safe_extra`
+        is `True`, the values in the extra dictionary are converted to
+        values that are safe for JSON export (and as such for pickling).
+        """
+        if isinstance(record, FrozenRecord):
+            return record
+        extra = record.extra
+        if safe_extra:
+            extra = to_safe_json(dict(extra))
+        rv = object.__new__(cls)
+        rv.__dict__.update(
+            channel=record.channel,
+            level=record.level,
+            msg=record.message,
+            time=record.time,
+            process=record.process,
+            process_name=record.process_name,
+            thread=record.thread,
+            thread_name=record.thread_name,
+            filename=record.filename,
+            lineno=record.lineno,
+            func_name=record.func_name,
+            module=record.module,
+            formatted_exception=record.formatted_exception,
+            exception_name=record.exception_name,
+            exception_message=record.exception_message,
+            extra=ExtraDict(extra)
+        )
+        return rv
+
+    def __setattr__(self, name, value):
+        if name not in self._mutable_attrs:
+            raise AttributeError('frozen records are immutable')
+        object.__setattr__(self, name, value)
+
+    def __reduce_ex__(self, protocol):
+        values = self.__dict__
+        return _create_frozen_record, (type(self), tuple(
+            values[key] for key in self._fields))
+
+    @property
+    def message(self):
+        """The formatted message."""
+        return self.msg
+
+    def to_dict(self, json_safe=False):
+        rv = dict(self.__dict__)
+        rv.update(args=(), kwargs={}, message=self.msg,
+                  information_pulled=True, extra=dict(self.extra))
+        if json_safe:
+            return to_safe_json(rv)
+        return rv
+
+    def close(self):
+        pass
+
+
 class LoggerMixin(object):
     """This mixin class defines and implements the "usual" logger
     interface (i.e. the descriptive logging functions).
@@ -825,6 +924,45 @@ class RecordDispatcher(object):
             if handler.handle(record) and not handler.bubble:
                 break
 
+    def call_handlers_batch(self, records):
+        """Like :meth:`call_handlers` but for a list of records.  The
+        handler stack is only looked up once and every handler gets all
+        records it is interested in in one go through
+        :meth:`~logbook.Handler.handle_batch`.  Each record still only
+        reaches the handlers that :meth:`call_handlers` would pass it to,
+        but a handler sees all of its records before the next handler
+        on the stack.
+        """
+        pending = list(records)
+        initialized = set()
+        for handler in chain(self.handlers, Handler.iter_context_objects()):
+            if not pending:
+                break
+            batch = [r for r in pending if r.level >= handler.level]
+            if not batch:
+                continue
+
+            # records stop at a blackhole handler, the others go on
+            if handler.blackhole:
+                pending = [r for r in pending if r.level < handler.level]
+                continue
+
+            for record in batch:
+                if id(record) not in initialized:
+                    record.heavy_init()
+                    self.process_record(record)
+                    initialized.add(id(record))
+
+            if handler.filter is not None:
+                batch = [r for r in batch if handler.filter(r, handler)]
+                if not batch:
+                    continue
+
+            handled = handler.handle_batch(batch)
+            if handled and not handler.bubble:
+                handled = set(map(id, handled))
+                pending = [r for r in pending if id(r) not in handled]
+
     def process_record(self, record):
         """Processes the record with all context specific processors.  This
         can be overriden to also inject additional information as necessary
@@ -911,4 +1049,12 @@ def dispatch_record(record):
     _default_dispatcher.call_handlers(record)
 
 
+def dispatch_records(records):
+    """Passes a list of records on to the handlers on the stack.  This
+    works like :func:`dispatch_record` but hands the records to the
+    handlers in batches (see :meth:`RecordDispatcher.call_handlers_batch`).
+    """
+    _default_dispatcher.call_handlers_batch(records)
+
+
 from logbook.handlers import Handler
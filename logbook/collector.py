@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+    logbook.collector
+    ~~~~~~~~~~~~~~~~~
+
+    Implements a log collector server that receives the records of many
+    :class:`~logbook.queues.SocketHandler`\s in one process.
+
+    :copyright: (c) 2010 by Armin Ronacher, Georg Brandl.
+    :license: BSD, see LICENSE for more details.
+"""
+from __future__ import with_statement
+
+import os
+import asyncore
+from threading import Thread, Lock
+from Queue import Queue, Empty
+
+from logbook.base import dispatch_records
+from logbook.queues import RecordDecoder, split_frames, _listen
+
+
+class _Listener(asyncore.dispatcher):
+
+    def __init__(self, collector, sock):
+        asyncore.dispatcher.__init__(self, sock, collector._map)
+        self.collector = collector
+        # the socket is listening already
+        self.accepting = True
+
+    def handle_accept(self):
+        rv = self.accept()
+        if rv is not None:
+            _Connection(self.collector, rv[0])
+
+    def handle_error(self):
+        # failed accepts (the client went away already) are ignored
+        pass
+
+
+class _Connection(asyncore.dispatcher):
+
+    def __init__(self, collector, sock):
+        asyncore.dispatcher.__init__(self, sock, collector._map)
+        self.collector = collector
+        self.decoder = RecordDecoder()
+        self.data = ''
+        #: the number of records of this connection that wait for the
+        #: dispatching thread.
+        self.queued = 0
+
+    def readable(self):
+        # a connection that is too far ahead is not read from until the
+        # dispatching thread caught up, the producer then blocks on the
+        # full socket buffers.
+        return self.queued < self.collector.max_queued
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        data = self.recv(65536)
+        if not data:
+            return
+        try:
+            frames, self.data = split_frames(self.data + data)
+        except ValueError:
+            self.close()
+            return
+        records = []
+        for frame in frames:
+            records.extend(self.decoder.decode_many(frame))
+        if records:
+            self.collector._enqueue(self, records)
+
+    def handle_close(self):
+        self.close()
+
+    def handle_error(self):
+        self.close()
+
+
+class _Wakeup(asyncore.file_dispatcher):
+
+    def __init__(self, collector, fd):
+        asyncore.file_dispatcher.__init__(self, fd, collector._map)
+        self.collector = collector
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        self.recv(512)
+        if self.collector._stopping:
+            for dispatcher in self.collector._map.values():
+                dispatcher.close()
+
+
+class Collector(object):
+    """A server that accepts connections of
+    :class:`~logbook.queues.SocketHandler`\s on any number of TCP addresses
+    and Unix domain sockets and dispatches their records to the handler
+    setup.  One collector per host can aggregate the records of all the
+    workers on it::
+
+        collector = Collector([('0.0.0.0', 5170), '/var/run/app/logs.sock'],
+                              setup=FileHandler('/var/log/app.log'))
+        collector.serve_forever()
+
+    The network side runs in one thread on :mod:`asyncore`, which waits for
+    the connections with :func:`select.poll` so that thousands of them are
+    no problem.  The decoded records are handed to a second thread which
+    pushes `setup` (any :class:`~logbook.base.StackedObject`) and
+    dispatches the records in batches of up to `batch_size` records with
+    :func:`~logbook.base.dispatch_records`.
+
+    If the handlers cannot keep up, the collector stops reading from each
+    connection that has `max_queued` records waiting to be dispatched,
+    until they were dispatched.  The socket buffers of the connection fill
+    up and the :class:`~logbook.queues.SocketHandler` on the other side
+    buffers (and eventually drops) the records instead of the collector
+    running out of memory.
+    """
+
+    def __init__(self, addresses, setup=None, batch_size=1000,
+                 max_queued=10000, backlog=128):
+        self.setup = setup
+        self.batch_size = batch_size
+        self.max_queued = max_queued
+        self._map = {}
+        self._queue = Queue()
+        self._lock = Lock()
+        self._stopping = False
+        self._thread = None
+        self._dispatcher = None
+        #: the addresses the collector listens on.
+        self.addresses = []
+        for address in addresses:
+            sock = _listen(address, backlog)
+            self.addresses.append(sock.getsockname())
+            _Listener(self, sock)
+        self._wakeup = os.pipe()
+        _Wakeup(self, self._wakeup[0])
+
+    def _enqueue(self, connection, records):
+        with self._lock:
+            connection.queued += len(records)
+        self._queue.put((connection, records))
+
+    def _wake(self):
+        os.write(self._wakeup[1], 'x')
+
+    def _dispatch(self, items):
+        dispatch_records([record for connection, records in items
+                          for record in records])
+        paused = False
+        with self._lock:
+            for connection, records in items:
+                if connection.queued >= self.max_queued:
+                    paused = True
+                connection.queued -= len(records)
+        # connections that were paused are readable again
+        if paused:
+            self._wake()
+
+    def _dispatch_forever(self):
+        if self.setup is not None:
+            self.setup.push_thread()
+        try:
+            running = True
+            while running:
+                items = []
+                size = 0
+                item = self._queue.get()
+                while 1:
+                    if item is None:
+                        running = False
+                        break
+                    items.append(item)
+                    size += len(item[1])
+                    if size >= self.batch_size:
+                        break
+                    try:
+                        item = self._queue.get_nowait()
+                    except Empty:
+                        break
+                if items:
+                    self._dispatch(items)
+        finally:
+            if self.setup is not None:
+                self.setup.pop_thread()
+
+    def serve_forever(self):
+        """Receives and dispatches records until :meth:`stop` is called."""
+        self._dispatcher = Thread(target=self._dispatch_forever)
+        self._dispatcher.setDaemon(True)
+        self._dispatcher.start()
+        try:
+            asyncore.loop(None, True, self._map)
+        finally:
+            self._queue.put(None)
+            self._dispatcher.join()
+            self._dispatcher = None
+            for fd in self._wakeup:
+                os.close(fd)
+
+    def start(self):
+        """Runs :meth:`serve_forever` in a background thread."""
+        self._thread = Thread(target=self.serve_forever)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        """Closes all connections and stops the collector.  The records
+        that were received are still dispatched.
+        """
+        self._stopping = True
+        self._wake()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -10,23 +10,25 @@
 """
 from __future__ import with_statement
 
+import re
 import os
 import sys
 import stat
+import time
 import errno
-import codecs
 import socket
 import hashlib
 import threading
 import traceback
 from datetime import datetime, timedelta
-from itertools import izip
-from threading import Lock
+from itertools import izip, count
+from threading import Lock, Thread
+from Queue import Queue
 
 from logbook.base import CRITICAL, ERROR, WARNING, NOTICE, INFO, DEBUG, \
      NOTSET, level_name_property, _missing, lookup_level, \
      ContextObject
-from logbook.helpers import rename, F
+from logbook.helpers import rename, gzip_file, F
 
 
 DEFAULT_FORMAT_STRING = (
@@ -63,6 +65,19 @@ Message:
 
 SYSLOG_PORT = 514
 
+# the smallest unit of time (0 = seconds up to 5 = years) that can change
+# the output of a strftime directive.  Directives not in here make the
+# timed rotating file handler format every record's time.
+_strftime_directive_re = re.compile(r'%(.)')
+_strftime_directive_units = dict(
+    [(x, 0) for x in 'ScXTsr'] +
+    [(x, 1) for x in 'MR'] +
+    [(x, 2) for x in 'HIpkl'] +
+    [(x, 3) for x in 'djaAwuexDFUWV'] +
+    [(x, 4) for x in 'mbBh'] +
+    [(x, 5) for x in 'yYGgC']
+)
+
 
 def create_syshandler(application_name, level=NOTSET):
     """Creates the handler the operating system provides.  On Unix systems
@@ -182,6 +197,16 @@ class Handler(ContextObject):
             self.handle_error(record, sys.exc_info())
         return True
 
+    def handle_batch(self, records):
+        """Handles a list of records in one go.  Like :meth:`handle` this
+        is invoked for every record regardless of the level of the handler.
+        Returns the records that were handled, the others bubble up.  The
+        default implementation calls :meth:`handle` for every record but
+        handlers can override this to amortize locking and I/O over many
+        records.
+        """
+        return [record for record in records if self.handle(record)]
+
     def emit(self, record):
         """Emit the specified logging record.  This should take the
         record and deliver it to whereever the handler sends formatted
@@ -394,20 +419,50 @@ class StreamHandler(Handler, StringFormatterHandlerMixin):
         if self.stream is not None and hasattr(self.stream, 'flush'):
             self.stream.flush()
 
+    def encode(self, msg):
+        """Encodes a formatted line to the stream encoding."""
+        enc = getattr(self.stream, 'encoding', None) or 'utf-8'
+        return msg.encode(enc, 'replace')
+
     def format_and_encode(self, record):
         """Formats the record and encodes it to the stream encoding."""
-        enc = getattr(self.stream, 'encoding', None) or 'utf-8'
-        return (self.format(record) + u'\n').encode(enc, 'replace')
+        return self.encode(self.format(record) + u'\n')
 
     def write(self, item):
         """Writes a bytestring to the stream."""
         self.stream.write(item)
 
     def emit(self, record):
+        # formatting (and with it traceback formatting) happens outside
+        # of the lock so that threads only serialize on the actual write.
+        # The encoding depends on the stream which might be swapped in the
+        # meantime (see StderrHandler), so encoding happens under the lock.
+        msg = self.format(record) + u'\n'
         with self.lock:
-            self.write(self.format_and_encode(record))
+            self.write(self.encode(msg))
             self.flush()
 
+    def handle_batch(self, records):
+        # subclasses that do more work in emit (rotating, checking the
+        # file) get the records one by one.
+        emit = getattr(self.emit, 'im_func', None)
+        if emit not in _batched_emits:
+            return Handler.handle_batch(self, records)
+        msgs = []
+        for record in records:
+            try:
+                msgs.append(self.format(record) + u'\n')
+            except Exception:
+                self.handle_error(record, sys.exc_info())
+        if msgs:
+            try:
+                with self.lock:
+                    self.write(self.encode(u''.join(msgs)))
+                    self.flush()
+            except Exception:
+                self.handle_error(records[-1], sys.exc_info())
+        return records
+
 
 class FileHandler(StreamHandler):
     """A handler that does the task of opening and closing files for you.
@@ -416,14 +471,39 @@ class FileHandler(StreamHandler):
 
     This is useful when the handler is used with a
     :class:`~logbook.more.FingersCrossedHandler` or something similar.
+
+    If `durable` is `True`, a record is on disk (``fdatasync``) when the
+    logging call returns.  Threads that log at the same time share one
+    sync: the first thread writes and syncs the records of all threads
+    that are waiting and then releases them together.  With a
+    `commit_interval` (in seconds) that thread waits up to that long for
+    more records to join the sync, unless `commit_batch_size` records are
+    waiting already.  That trades latency for fewer syncs.  If the sync
+    fails, the logging calls of all records that were part of it fail
+    (see :meth:`~logbook.Handler.handle_error`); the sync is not retried
+    because the operating system might have dropped the data already.
     """
 
     def __init__(self, filename, mode='a', encoding='utf-8', level=NOTSET,
-                 format_string=None, delay=False, filter=None, bubble=False):
+                 format_string=None, delay=False, filter=None, bubble=False,
+                 durable=False, commit_interval=0, commit_batch_size=100):
         StreamHandler.__init__(self, None, level, format_string, filter, bubble)
         self._filename = filename
         self._mode = mode
         self._encoding = encoding
+        self.durable = durable
+        self.commit_interval = commit_interval
+        self.commit_batch_size = commit_batch_size
+        # group commit state: the number of writes, the number of the
+        # last write on disk and if a thread is syncing right now.
+        self._written = 0
+        self._synced = 0
+        self._committing = False
+        # failed syncs: first and last write, the number of writes that
+        # did not see the error yet and the error.
+        self._failed_syncs = []
+        self._commit_done = threading.Condition(self.lock)
+        self._batch_full = threading.Condition(self.lock)
         if delay:
             self.stream = None
         else:
@@ -432,7 +512,17 @@ class FileHandler(StreamHandler):
     def _open(self, mode=None):
         if mode is None:
             mode = self._mode
-        self.stream = codecs.open(self._filename, mode, self._encoding)
+        # records are encoded before they are written, so the file itself
+        # is opened in binary mode.
+        if 'b' not in mode:
+            mode += 'b'
+        self.stream = open(self._filename, mode)
+
+    def encode(self, msg):
+        """Encodes a formatted line to the file encoding.  This does not
+        require the file to be opened.
+        """
+        return msg.encode(self._encoding or 'utf-8', 'replace')
 
     def write(self, item):
         if self.stream is None:
@@ -445,10 +535,83 @@ class FileHandler(StreamHandler):
             self.stream.close()
             self.stream = None
 
+    def _write_durably(self, item):
+        """Writes the item and returns once it is on disk, syncing the
+        items of other threads along with it.
+        """
+        with self.lock:
+            self.write(item)
+            self._written += 1
+            ticket = self._written
+            if self._written - self._synced >= self.commit_batch_size:
+                self._batch_full.notify()
+            while self._synced < ticket:
+                if self._committing:
+                    self._commit_done.wait()
+                    continue
+                self._committing = True
+                try:
+                    if self.commit_interval and \
+                       self._written - self._synced < self.commit_batch_size:
+                        self._batch_full.wait(self.commit_interval)
+                    target = self._written
+                    self.flush()
+                    fd = self.stream.fileno()
+                    error = None
+                    self.lock.release()
+                    try:
+                        try:
+                            _fdatasync(fd)
+                        except Exception, e:
+                            error = e
+                    finally:
+                        self.lock.acquire()
+                    if error is not None:
+                        self._failed_syncs.append([self._synced + 1, target,
+                                                   target - self._synced,
+                                                   error])
+                    self._synced = target
+                finally:
+                    self._committing = False
+                    self._commit_done.notifyAll()
+            for failed in self._failed_syncs:
+                if failed[0] <= ticket <= failed[1]:
+                    failed[2] -= 1
+                    if not failed[2]:
+                        self._failed_syncs.remove(failed)
+                    raise failed[3]
+
     def emit(self, record):
-        if self.stream is None:
-            self._open()
-        StreamHandler.emit(self, record)
+        # the file encoding is fixed, so unlike for the stream handler
+        # the encoding can happen outside of the lock too.
+        msg = self.format_and_encode(record)
+        if self.durable:
+            self._write_durably(msg)
+            return
+        with self.lock:
+            self.write(msg)
+            self.flush()
+
+    def handle_batch(self, records):
+        emit = getattr(self.emit, 'im_func', None)
+        if not self.durable or emit not in _batched_emits:
+            return StreamHandler.handle_batch(self, records)
+        msgs = []
+        for record in records:
+            try:
+                msgs.append(self.format_and_encode(record))
+            except Exception:
+                self.handle_error(record, sys.exc_info())
+        if msgs:
+            try:
+                self._write_durably(''.join(msgs))
+            except Exception:
+                self.handle_error(records[-1], sys.exc_info())
+        return records
+
+
+_batched_emits = (StreamHandler.emit.im_func, FileHandler.emit.im_func)
+_fdatasync = getattr(os, 'fdatasync', os.fsync)
 
 
 class MonitoringFileHandler(FileHandler):
@@ -456,38 +619,56 @@ class MonitoringFileHandler(FileHandler):
     open.  This might happen on POSIX systems if an application like
     logrotate moves the logfile over.
 
+    The check compares the file at the filename with the file that is
+    currently open.  By default this happens for every record, if you
+    log a lot, you can set `check_interval` to the number of seconds
+    that should pass between two checks.  Records logged between a move
+    and the next check still end up in the moved file.
+
     Because of different IO concepts on Windows, this handler will not
     work on a windows system.
     """
 
     def __init__(self, filename, mode='a', encoding='utf-8', level=NOTSET,
-                 format_string=None, delay=False, filter=None, bubble=False):
-        FileHandler.__init__(self, filename, mode, encoding, level,
-                             format_string, delay, filter, bubble)
+                 format_string=None, delay=False, filter=None, bubble=False,
+                 check_interval=0):
         if os.name == 'nt':
             raise RuntimeError('MonitoringFileHandler does not support Windows')
-        self._query_fd()
+        self.check_interval = check_interval
+        self._stream_id = None
+        self._next_check = 0
+        FileHandler.__init__(self, filename, mode, encoding, level,
+                             format_string, delay, filter, bubble)
 
-    def _query_fd(self):
-        if self.stream is None:
-            self._last_stat = None, None
-        else:
-            try:
-                st = os.stat(self._filename)
-            except OSError, e:
-                if e.errno != 2:
-                    raise
-                self._last_stat = None, None
-            else:
-                self._last_stat = st[stat.ST_DEV], st[stat.ST_INO]
+    def _open(self, mode=None):
+        FileHandler._open(self, mode)
+        st = os.fstat(self.stream.fileno())
+        self._stream_id = st[stat.ST_DEV], st[stat.ST_INO]
+        self._next_check = time.time() + self.check_interval
+
+    def file_moved(self):
+        """Returns `True` if the file at the filename is not the file the
+        handler writes to.
+        """
+        try:
+            st = os.stat(self._filename)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return True
+        return (st[stat.ST_DEV], st[stat.ST_INO]) != self._stream_id
 
     def emit(self, record):
-        last_stat = self._last_stat
-        self._query_fd()
-        if last_stat != self._last_stat:
-            self.close()
-        FileHandler.emit(self, record)
-        self._query_fd()
+        msg = self.format_and_encode(record)
+        with self.lock:
+            if self.stream is not None:
+                now = time.time()
+                if now >= self._next_check:
+                    self._next_check = now + self.check_interval
+                    if self.file_moved():
+                        self.close()
+            self.write(msg)
+            self.flush()
 
 
 class StderrHandler(StreamHandler):
@@ -509,12 +690,77 @@ class StderrHandler(StreamHandler):
         return sys.stderr
 
 
+class MaintenanceThread(object):
+    """A background thread that performs file maintenance tasks for the
+    rotating file handlers (like renaming backup files) one after another
+    in the order they were submitted.  This keeps slow directory
+    operations away from the threads that are logging.
+
+    The thread is started when the first task is submitted.
+    """
+    _sentinel = object()
+
+    def __init__(self):
+        self.queue = Queue(-1)
+        self._lock = Lock()
+        self._thread = None
+
+    def submit(self, func, *args):
+        """Schedules `func` to be called with `args` in the background."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = Thread(target=self._target)
+                self._thread.setDaemon(True)
+                self._thread.start()
+        self.queue.put((func, args))
+
+    def join(self):
+        """Waits until all tasks submitted so far are done."""
+        self.queue.join()
+
+    def stop(self):
+        """Finishes all pending tasks and stops the thread."""
+        with self._lock:
+            thread = self._thread
+            if thread is None:
+                return
+            self._thread = None
+            self.queue.put(self._sentinel)
+        thread.join()
+
+    def _target(self):
+        while 1:
+            task = self.queue.get()
+            try:
+                if task is self._sentinel:
+                    break
+                func, args = task
+                try:
+                    func(*args)
+                except Exception:
+                    try:
+                        traceback.print_exc(None, sys.stderr)
+                    except IOError:
+                        pass
+            finally:
+                self.queue.task_done()
+
+
 class RotatingFileHandlerBase(FileHandler):
     """Baseclass for rotating file handlers."""
 
+    #: the :class:`MaintenanceThread` for background work after rollovers
+    #: or `None` if the handler does all the work in the logging thread.
+    _maintenance = None
+
+    def close(self):
+        FileHandler.close(self)
+        if self._maintenance is not None:
+            self._maintenance.stop()
+
     def emit(self, record):
+        msg = self.format_and_encode(record)
         with self.lock:
-            msg = self.format_and_encode(record)
             if self.should_rollover(record, len(msg)):
                 self.perform_rollover()
             self.write(msg)
@@ -546,34 +792,164 @@ class RotatingFileHandler(RotatingFileHandlerBase):
     the logging package, the backup count is mandatory because just
     reopening the file is dangerous as it deletes the log without
     asking on rollover.
+
+    The size of the file is tracked in memory and only compared with the
+    actual file size once the tracked size reaches `max_size`.  If other
+    handlers or processes append to the same file, their writes are not
+    accounted for until then and the file can grow to roughly twice the
+    maximum size before it is rotated.
+
+    If `background_rollover` is set to `True`, a rollover only moves the
+    current file out of the way and swaps in a new file that was created
+    beforehand (named like the file with ``.next`` appended).  Renaming
+    the backup files happens in a background thread
+    (:class:`MaintenanceThread`), so other threads logging to this handler
+    do not have to wait for it.  :meth:`close` waits for pending renames.
+
+    If `compress` is set to `True` the backup files are compressed with
+    gzip (``mail.1.gz``, ``mail.2.gz`` and so on).  This implies
+    `background_rollover`, the compression happens in the background
+    thread as well.  The `backup_count` counts the compressed files.
     """
 
     def __init__(self, filename, mode='a', encoding='utf-8', level=NOTSET,
                  format_string=None, delay=False, max_size=1024 * 1024,
-                 backup_count=5, filter=None, bubble=False):
+                 backup_count=5, filter=None, bubble=False,
+                 background_rollover=False, compress=False):
+        # the size of the current file is tracked in memory so that the
+        # rollover check does not have to ask the operating system for
+        # the file size for every record.
+        self._size = 0
+        self._next_stream = None
         RotatingFileHandlerBase.__init__(self, filename, mode, encoding, level,
                                          format_string, delay, filter, bubble)
         self.max_size = max_size
         self.backup_count = backup_count
         assert backup_count > 0, 'at least one backup file has to be ' \
                                  'specified'
+        self.compress = compress
+        if background_rollover or compress:
+            self._rollover_counter = count(1).next
+            self._maintenance = MaintenanceThread()
+            self._maintenance.submit(self._remove_leftovers)
+            self._maintenance.submit(self._prepare_next_file)
+
+    @property
+    def _next_filename(self):
+        return self._filename + '.next'
+
+    def _open(self, mode=None):
+        RotatingFileHandlerBase._open(self, mode)
+        self._sync_size()
+
+    def _sync_size(self):
+        self._size = os.fstat(self.stream.fileno()).st_size
+
+    def write(self, item):
+        RotatingFileHandlerBase.write(self, item)
+        self._size += len(item)
 
     def should_rollover(self, record, bytes):
-        self.stream.seek(0, 2)
-        return self.stream.tell() + bytes >= self.max_size
+        if self.stream is None:
+            self._open()
+        if self._size + bytes < self.max_size:
+            return False
+        # before rolling over make sure the file was not truncated in the
+        # meantime (logrotate's copytruncate for example), in which case
+        # the tracked size is wrong.
+        self._sync_size()
+        return self._size + bytes >= self.max_size
 
-    def perform_rollover(self):
-        self.stream.close()
+    def close(self):
+        RotatingFileHandlerBase.close(self)
+        if self._maintenance is not None:
+            with self.lock:
+                if self._next_stream is not None:
+                    self._next_stream.close()
+                    self._next_stream = None
+                    os.remove(self._next_filename)
+
+    def rotate_backups(self, filename):
+        """Moves the existing backup files one number up (deleting the
+        oldest one) and moves `filename` to the first backup file.  In
+        background mode this is called from the maintenance thread.
+        """
+        suffix = self.compress and '.gz' or ''
         for x in xrange(self.backup_count - 1, 0, -1):
-            src = '%s.%d' % (self._filename, x)
-            dst = '%s.%d' % (self._filename, x + 1)
+            src = '%s.%d%s' % (self._filename, x, suffix)
+            dst = '%s.%d%s' % (self._filename, x + 1, suffix)
             try:
                 rename(src, dst)
             except OSError, e:
                 if e.errno != errno.ENOENT:
                     raise
-        rename(self._filename, self._filename + '.1')
-        self._open('w')
+        rename(filename, self._filename + '.1')
+        if self.compress:
+            gzip_file(self._filename + '.1')
+
+    def _remove_leftovers(self):
+        """Removes the temporary files of background rollovers that were
+        interrupted because the process that did them died.
+        """
+        dirname, basename = os.path.split(os.path.abspath(self._filename))
+        leftover_re = re.compile(r'^%s\.(?:rollover|next)-(\d+)-\d+$'
+                                 % re.escape(basename))
+        for filename in os.listdir(dirname):
+            match = leftover_re.match(filename)
+            if match is None:
+                continue
+            pid = int(match.group(1))
+            if pid == os.getpid():
+                continue
+            try:
+                os.kill(pid, 0)
+                continue
+            except OSError, e:
+                if e.errno != errno.ESRCH:
+                    continue
+            try:
+                os.remove(os.path.join(dirname, filename))
+            except OSError:
+                pass
+
+    def _prepare_next_file(self):
+        # the file is created under a name of its own and only becomes
+        # the next file under the lock, so that a rollover can never take
+        # a file another prepare still holds on to.
+        filename = '%s.next-%d-%d' % (self._filename, os.getpid(),
+                                      self._rollover_counter())
+        stream = open(filename, 'wb')
+        with self.lock:
+            if self._next_stream is None:
+                rename(filename, self._next_filename)
+                self._next_stream = stream
+                return
+        stream.close()
+        os.remove(filename)
+
+    def perform_rollover(self):
+        self.stream.close()
+        if self._maintenance is None:
+            self.rotate_backups(self._filename)
+            self._open('w')
+            return
+
+        # move the current file out of the way and hand the renaming of
+        # the backups to the maintenance thread.  If the next file was
+        # already created in the background it's swapped in, otherwise
+        # a new file is opened right away.
+        pending = '%s.rollover-%d-%d' % (self._filename, os.getpid(),
+                                        self._rollover_counter())
+        rename(self._filename, pending)
+        if self._next_stream is not None:
+            rename(self._next_filename, self._filename)
+            self.stream = self._next_stream
+            self._next_stream = None
+            self._sync_size()
+        else:
+            self._open('w')
+        self._maintenance.submit(self.rotate_backups, pending)
+        self._maintenance.submit(self._prepare_next_file)
 
 
 class TimedRotatingFileHandler(RotatingFileHandlerBase):
@@ -592,51 +968,320 @@ class TimedRotatingFileHandler(RotatingFileHandlerBase):
         ...
 
     By default it will keep all these files around, if you want to limit
-    them, you can specify a `backup_count`.
+    them, you can specify a `backup_count`.  The directory is only listed
+    once to find existing log files, afterwards the handler keeps track
+    of its files in memory.
+
+    If `compress` is set to `True`, files are compressed with gzip after
+    the rollover in a background thread (``/var/log/foo-2010-01-10.log.gz``).
+    Removing old files then happens in the background thread as well and
+    compressed files count against the `backup_count`.
     """
 
     def __init__(self, filename, mode='a', encoding='utf-8', level=NOTSET,
                  format_string=None, date_format='%Y-%m-%d',
-                 backup_count=0, filter=None, bubble=False):
+                 backup_count=0, filter=None, bubble=False, compress=False):
         RotatingFileHandlerBase.__init__(self, filename, mode, encoding, level,
                                          format_string, True, filter, bubble)
         self.date_format = date_format
         self.backup_count = backup_count
+        self.compress = compress
         self._fn_parts = os.path.splitext(os.path.abspath(filename))
         self._filename = None
+        # the time span in which records end up in the current file.  As
+        # long as records fall into it, no filename has to be formatted.
+        self._period_start = self._period_end = None
+        self._unit = self._get_rollover_unit()
+        # the old log files ordered by age, oldest first.  Read from the
+        # directory on the first rollover.
+        self._retained_files = None
+        if compress:
+            self._maintenance = MaintenanceThread()
 
     def _get_timed_filename(self, datetime):
         return datetime.strftime('-' + self.date_format) \
                        .join(self._fn_parts)
 
+    def _get_rollover_unit(self):
+        unit = 5
+        for directive in _strftime_directive_re.findall(self.date_format):
+            if directive == '%':
+                continue
+            if directive not in _strftime_directive_units:
+                return None
+            unit = min(unit, _strftime_directive_units[directive])
+        return unit
+
+    def _get_period(self, dt):
+        """Returns the start and end of the time span around `dt` in which
+        the date format cannot change.  The returned span may be shorter
+        than the time one file covers (weeks for instance are split into
+        days) which only means that the filename is formatted again at the
+        end of the span.
+        """
+        unit = self._unit
+        if unit is None:
+            return None, None
+        start = dt.replace(microsecond=0)
+        if unit >= 1:
+            start = start.replace(second=0)
+        if unit >= 2:
+            start = start.replace(minute=0)
+        if unit >= 3:
+            start = start.replace(hour=0)
+        if unit >= 4:
+            start = start.replace(day=1)
+        if unit >= 5:
+            start = start.replace(month=1)
+        try:
+            if unit == 5:
+                end = start.replace(year=start.year + 1)
+            elif unit == 4:
+                if start.month == 12:
+                    end = start.replace(year=start.year + 1, month=1)
+                else:
+                    end = start.replace(month=start.month + 1)
+            else:
+                end = start + timedelta(seconds=(1, 60, 3600, 86400)[unit])
+        except (ValueError, OverflowError):
+            end = datetime.max
+        return start, end
+
     def should_rollover(self, record, bytes):
-        fn = self._get_timed_filename(record.time)
+        dt = record.time
+        if self._period_start is not None and \
+           self._period_start <= dt < self._period_end:
+            return False
+        fn = self._get_timed_filename(dt)
         rv = self._filename is not None and self._filename != fn
         # remember the current filename.  In case rv is True, the rollover
         # performing function will already have the new filename
         self._filename = fn
+        self._period_start, self._period_end = self._get_period(dt)
         return rv
 
-    def files_to_delete(self):
-        """Returns a list with the files that have to be deleted when
-        a rollover occours.
-        """
-        directory = os.path.dirname(self._filename)
+    def _scan_files(self):
+        directory = os.path.dirname(self._fn_parts[0])
+        prefix = self._fn_parts[0] + '-'
+        extensions = (self._fn_parts[1], self._fn_parts[1] + '.gz')
         files = []
         for filename in os.listdir(directory):
             filename = os.path.join(directory, filename)
-            if filename.startswith(self._fn_parts[0] + '-') and \
-               filename.endswith(self._fn_parts[1]):
+            if filename != self._filename and \
+               filename.startswith(prefix) and \
+               filename.endswith(extensions):
                 files.append((os.path.getmtime(filename), filename))
         files.sort()
-        return files[:-self.backup_count + 1]
+        return [filename for mtime, filename in files]
+
+    def _retain(self, filename):
+        files = self._retained_files
+        if files is None:
+            return
+        for fn in filename, self._filename:
+            if fn in files:
+                files.remove(fn)
+        files.append(filename)
+
+    def files_to_delete(self):
+        """Returns a list with the files that have to be deleted when
+        a rollover occours.  The current file is never deleted and counts
+        against the `backup_count`.
+        """
+        if self._retained_files is None:
+            self._retained_files = self._scan_files()
+        if self.backup_count > 1:
+            return self._retained_files[:-self.backup_count + 1]
+        return self._retained_files[:]
+
+    def delete_old_files(self):
+        """Deletes the files returned by :meth:`files_to_delete`."""
+        files = self.files_to_delete()
+        for filename in files:
+            try:
+                os.remove(filename)
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+        del self._retained_files[:len(files)]
+
+    def _finish_rollover(self, filename):
+        if self.compress:
+            filename = gzip_file(filename)
+        if self.backup_count > 0:
+            self._retain(filename)
+            self.delete_old_files()
 
     def perform_rollover(self):
+        old_filename = self.stream.name
         self.stream.close()
-        if self.backup_count > 0:
-            for time, filename in self.files_to_delete():
-                os.remove(filename)
-        self._open('w')
+        if self._maintenance is not None:
+            self._open('w')
+            self._maintenance.submit(self._finish_rollover, old_filename)
+        else:
+            self._finish_rollover(old_filename)
+            self._open('w')
+
+
+class SharedRotatingFileHandler(FileHandler):
+    """A size based rotating file handler for several processes that log
+    into the same file (like the workers of a pre-forking server).
+
+    Each record is written with a single ``write`` call to a file opened
+    with ``O_APPEND`` so the operating system appends the records of
+    different processes without interleaving them.  If `max_record_size`
+    is given, encoded records are cut to that many bytes (including the
+    newline), which is useful for pipes or network filesystems that only
+    guarantee atomic writes up to ``PIPE_BUF`` bytes.  Only appending
+    `mode`\s are supported.
+
+    There is no lock between the processes when logging records.  Only
+    once every `check_interval` seconds each process looks at the size of
+    the file.  The process that finds the file too big takes an exclusive
+    ``fcntl`` lock on a lock file (the filename with ``.lock`` appended)
+    and renames the backup files like the :class:`RotatingFileHandler`
+    does.  The other processes notice that the filename points to a new
+    file at their next check and reopen it.  Because of that the file can
+    grow beyond `max_size` by whatever is logged during one interval.
+
+    This handler requires the :mod:`fcntl` module and does not work on
+    Windows.
+    """
+
+    def __init__(self, filename, mode='a', encoding='utf-8', level=NOTSET,
+                 format_string=None, delay=False, max_size=1024 * 1024,
+                 backup_count=5, filter=None, bubble=False,
+                 check_interval=1, max_record_size=None):
+        if mode.replace('b', '') != 'a':
+            raise ValueError('SharedRotatingFileHandler only supports '
+                             'appending, not mode %r' % mode)
+        try:
+            import fcntl
+        except ImportError:
+            raise RuntimeError('SharedRotatingFileHandler requires the '
+                               'fcntl module')
+        self._fcntl = fcntl
+        self._fd = None
+        self._stream_id = None
+        self._next_check = 0
+        FileHandler.__init__(self, filename, 'a', encoding, level,
+                             format_string, True, filter, bubble)
+        self.max_size = max_size
+        self.backup_count = backup_count
+        assert backup_count > 0, 'at least one backup file has to be ' \
+                                 'specified'
+        self.check_interval = check_interval
+        self.max_record_size = max_record_size
+        if not delay:
+            self._open()
+
+    @property
+    def _lock_filename(self):
+        return self._filename + '.lock'
+
+    def _open(self, mode=None):
+        self._fd = os.open(self._filename,
+                           os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0666)
+        st = os.fstat(self._fd)
+        self._stream_id = st[stat.ST_DEV], st[stat.ST_INO]
+        self._next_check = time.time() + self.check_interval
+
+    def _reopen(self):
+        os.close(self._fd)
+        self._open()
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def flush(self):
+        pass
+
+    def encode(self, msg):
+        rv = FileHandler.encode(self, msg)
+        limit = self.max_record_size
+        if limit is not None and len(rv) > limit:
+            encoding = self._encoding or 'utf-8'
+            rv = rv[:limit - 1].decode(encoding, 'ignore') \
+                               .encode(encoding) + '\n'
+        return rv
+
+    def write(self, item):
+        if self._fd is None:
+            self._open()
+        while item:
+            item = item[os.write(self._fd, item):]
+
+    def _query_file(self):
+        """Returns the identity and size of the file at the filename or
+        `None` if there is no file.
+        """
+        try:
+            st = os.stat(self._filename)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+        return (st[stat.ST_DEV], st[stat.ST_INO]), st[stat.ST_SIZE]
+
+    def check_file(self):
+        """Reopens the file if another process rotated it and rotates it
+        if it is too big.  This is called once every `check_interval`
+        seconds and needs to be called with the handler lock held.
+        """
+        info = self._query_file()
+        if info is None or info[0] != self._stream_id:
+            self._reopen()
+        elif info[1] >= self.max_size:
+            self.perform_rollover()
+
+    def perform_rollover(self):
+        """Rotates the file under the interprocess lock unless another
+        process already did.
+        """
+        fcntl = self._fcntl
+        lock_fd = os.open(self._lock_filename, os.O_RDWR | os.O_CREAT, 0666)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            try:
+                info = self._query_file()
+                # another process might have rotated while this one was
+                # waiting for the lock.
+                if info is not None and info[0] == self._stream_id and \
+                   info[1] >= self.max_size:
+                    self.rotate_backups()
+                self._reopen()
+            finally:
+                fcntl.flock(lock_fd, fcntl.LOCK_UN)
+        finally:
+            os.close(lock_fd)
+
+    def rotate_backups(self):
+        """Moves the backup files one number up (removing the oldest one)
+        and moves the file to the first backup file.
+        """
+        for x in xrange(self.backup_count - 1, 0, -1):
+            src = '%s.%d' % (self._filename, x)
+            dst = '%s.%d' % (self._filename, x + 1)
+            try:
+                rename(src, dst)
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+        rename(self._filename, self._filename + '.1')
+
+    def emit(self, record):
+        msg = self.format_and_encode(record)
+        with self.lock:
+            if self._fd is None:
+                self._open()
+            else:
+                now = time.time()
+                if now >= self._next_check:
+                    self._next_check = now + self.check_interval
+                    self.check_file()
+            self.write(msg)
 
 
 class TestHandler(Handler, StringFormatterHandlerMixin):
@@ -121,6 +121,33 @@ else:
     can_rename_open_file = True
 
 
+def gzip_file(filename):
+    """Compresses a file with gzip.  The compressed data is written to a
+    temporary file first that is then renamed to the final filename (the
+    filename with ``.gz`` appended), afterwards the original file is
+    removed.  The modification time of the original file is kept.  Returns
+    the new filename.
+    """
+    import gzip
+    import shutil
+    dst = filename + '.gz'
+    tmp = dst + '.tmp'
+    src = open(filename, 'rb')
+    try:
+        f = gzip.open(tmp, 'wb')
+        try:
+            shutil.copyfileobj(src, f)
+        finally:
+            f.close()
+    finally:
+        src.close()
+    st = os.stat(filename)
+    os.utime(tmp, (st.st_atime, st.st_mtime))
+    rename(tmp, dst)
+    os.remove(filename)
+    return dst
+
+
 def to_safe_json(data):
     """Makes a data structure safe for JSON silently discarding invalid
     objects from nested structures.  This also converts dates.
@@ -14,6 +14,9 @@ import re
 import os
 import sys
 import time
+import mmap
+import struct
+from datetime import datetime
 from collections import deque
 from threading import Lock
 from cgi import parse_qsl
@@ -31,6 +34,17 @@ u'[{record.channel}] {record.level_name}: {record.message}'
 TWITTER_ACCESS_TOKEN_URL = 'https://twitter.com/oauth/access_token'
 NEW_TWEET_URL = 'https://api.twitter.com/1/statuses/update.json'
 
+# the flight recorder file starts with a header (magic, size of the ring
+# buffer, absolute offsets of the oldest entry and the end of the newest
+# entry and the last sequence number) followed by the ring buffer.  Each
+# entry starts with its length, a length of zero marks the wrap around.
+_flight_header = struct.Struct('<8sIQQQ')
+_flight_entry = struct.Struct('<IQdHIHII')
+_flight_length = struct.Struct('<I')
+_flight_magic = 'LBFLIGHT'
+_flight_data_offset = 64
+_epoch = datetime(1970, 1, 1)
+
 
 class TaggingLogger(RecordDispatcher):
     """A logger that attaches a tag to each record.  This is an alternative
@@ -202,6 +216,296 @@ class FingersCrossedHandler(Handler):
                 self.enqueue(record)
 
 
+class CircuitBreakerHandler(Handler):
+    """Wraps a handler that talks to something that can fail (a syslog
+    daemon, a mail server, a database) and stops calling it while it
+    fails.  After `failure_threshold` records in a row failed, the circuit
+    opens: records are dropped right away (and counted in :attr:`dropped`)
+    for `reset_timeout` seconds.  Then the next record is passed on as a
+    probe.  If it goes through the circuit closes again, otherwise it stays
+    open for twice as long as before, up to `max_reset_timeout` seconds::
+
+        handler = CircuitBreakerHandler(SyslogHandler(), failure_threshold=3)
+
+    The errors of the wrapped handler go to its
+    :meth:`~logbook.Handler.handle_error`, but at most one every
+    `error_interval` seconds.  The number of errors that were not reported
+    in between is written to stderr with the next one.
+    """
+
+    # the clock of the timeouts, tests replace it
+    _time = staticmethod(time.time)
+
+    def __init__(self, handler, failure_threshold=5, reset_timeout=1,
+                 max_reset_timeout=60, error_interval=60, level=NOTSET,
+                 filter=None, bubble=False):
+        Handler.__init__(self, level, filter, bubble)
+        self.lock = Lock()
+        self.handler = handler
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.error_interval = error_interval
+        #: the number of records that were dropped while the circuit
+        #: was open.
+        self.dropped = 0
+        self._failures = 0
+        self._timeout = reset_timeout
+        self._open_until = None
+        self._probing = False
+        self._next_error = 0
+        self._suppressed_errors = 0
+
+    @property
+    def open(self):
+        """`True` while records are not passed on."""
+        return self._open_until is not None
+
+    def close(self):
+        self.handler.close()
+
+    def _report_error(self, record, exc_info):
+        now = self._time()
+        with self.lock:
+            if now < self._next_error:
+                self._suppressed_errors += 1
+                return
+            self._next_error = now + self.error_interval
+            suppressed = self._suppressed_errors
+            self._suppressed_errors = 0
+        if suppressed:
+            try:
+                sys.stderr.write('%d more errors of %r were not reported\n'
+                                 % (suppressed, self.handler))
+            except IOError:
+                pass
+        self.handler.handle_error(record, exc_info)
+
+    def emit(self, record):
+        with self.lock:
+            if self._open_until is not None:
+                if self._probing or self._time() < self._open_until:
+                    self.dropped += 1
+                    return
+                self._probing = True
+        try:
+            self.handler.emit(record)
+        except Exception:
+            exc_info = sys.exc_info()
+            with self.lock:
+                self._failures += 1
+                if self._probing:
+                    self._probing = False
+                    self._timeout = min(self._timeout * 2,
+                                        self.max_reset_timeout)
+                    self._open_until = self._time() + self._timeout
+                elif self._open_until is None and \
+                     self._failures >= self.failure_threshold:
+                    self._timeout = self.reset_timeout
+                    self._open_until = self._time() + self._timeout
+            self._report_error(record, exc_info)
+        else:
+            if self._failures or self._probing:
+                with self.lock:
+                    self._failures = 0
+                    self._probing = False
+                    self._open_until = None
+
+
+class FlightRecorderHandler(Handler):
+    """A handler that keeps the most recent records in a fixed size ring
+    buffer in a memory mapped file.  Logging a record only copies the
+    encoded record into the mapping, the operating system writes the
+    pages to the file.  That makes it cheap enough to record everything
+    (including debug records) all the time and because the data lives in
+    the file, the last records survive a crash of the process (even a
+    ``kill -9``).  Only a crash of the machine itself loses the records
+    the operating system did not write to disk yet.
+
+    `size` is the size of the ring buffer in bytes.  Once it is full the
+    oldest records are overwritten.  If the file exists and has the same
+    size it is continued instead of cleared, so a restarted application
+    does not overwrite the records of the crashed one right away.
+
+    Stored are the channel, level, time, process id, message and the
+    formatted traceback.  To get the records back, use
+    :func:`read_flight_recording`::
+
+        for record in read_flight_recording('/var/run/app.flight'):
+            print record.time, record.level_name, record.message
+
+    Only one handler in one process may write to a file at a time.
+    """
+
+    def __init__(self, filename, size=4 * 1024 * 1024, level=NOTSET,
+                 filter=None, bubble=False):
+        Handler.__init__(self, level, filter, bubble)
+        self.lock = Lock()
+        self._filename = filename
+        self._size = size
+        total = _flight_data_offset + size
+        fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0666)
+        try:
+            existing = os.fstat(fd).st_size
+            if existing != total:
+                os.ftruncate(fd, total)
+            self._buffer = mmap.mmap(fd, total)
+        finally:
+            os.close(fd)
+        magic, old_size, tail, head, seq = \
+            _flight_header.unpack_from(self._buffer, 0)
+        if existing != total or magic != _flight_magic or old_size != size \
+           or not tail <= head <= tail + size:
+            tail = head = seq = 0
+        self._tail = tail
+        self._head = head
+        self._seq = seq
+        self._write_header()
+
+    def _write_header(self):
+        _flight_header.pack_into(self._buffer, 0, _flight_magic, self._size,
+                                 self._tail, self._head, self._seq)
+
+    def close(self):
+        with self.lock:
+            if self._buffer is not None:
+                self._buffer.close()
+                self._buffer = None
+
+    def encode_record(self, record):
+        """Encodes a record into an entry of the ring buffer."""
+        channel = (record.channel or u'').encode('utf-8', 'replace')
+        message = record.message
+        if isinstance(message, unicode):
+            message = message.encode('utf-8', 'replace')
+        else:
+            message = str(message)
+        exception = record.formatted_exception or ''
+        if isinstance(exception, unicode):
+            exception = exception.encode('utf-8', 'replace')
+        # cut the entry to fit into the buffer, tracebacks first
+        room = self._size - _flight_entry.size - len(channel)
+        exception = exception[:max(0, room - len(message))]
+        message = message[:max(0, room)]
+        delta = record.time - _epoch
+        length = _flight_entry.size + len(channel) + len(message) + \
+                 len(exception)
+        return _flight_entry.pack(length, 0, delta.days * 86400 +
+            delta.seconds + delta.microseconds / 1e6, record.level,
+            record.process or 0, len(channel), len(message),
+            len(exception)) + channel + message + exception
+
+    def _free(self, limit):
+        """Moves the tail forward until it is at or after `limit`."""
+        size = self._size
+        buffer = self._buffer
+        tail = self._tail
+        while tail < limit and tail < self._head:
+            pos = tail % size
+            if size - pos < _flight_length.size:
+                length = 0
+            else:
+                length = _flight_length.unpack_from(
+                    buffer, _flight_data_offset + pos)[0]
+            if length == 0:
+                tail += size - pos
+            else:
+                tail += length
+        self._tail = tail
+
+    def _append(self, data):
+        size = self._size
+        buffer = self._buffer
+        head = self._head
+        pos = head % size
+        end = head
+        if pos + len(data) > size:
+            end += size - pos
+        # the tail has to be moved before anything is overwritten so that
+        # the file is valid at all times.
+        self._free(end + len(data) - size)
+        if self._tail >= head:
+            self._tail = end
+        self._seq += 1
+        self._write_header()
+        if end != head:
+            if size - pos >= _flight_length.size:
+                _flight_length.pack_into(buffer, _flight_data_offset + pos, 0)
+            pos = 0
+        offset = _flight_data_offset + pos
+        buffer[offset:offset + len(data)] = data
+        struct.pack_into('<Q', buffer, offset + _flight_length.size,
+                         self._seq)
+        self._head = end + len(data)
+        self._write_header()
+
+    def emit(self, record):
+        data = self.encode_record(record)
+        with self.lock:
+            if self._buffer is not None:
+                self._append(data)
+
+
+def read_flight_recording(filename):
+    """Reads the records a :class:`FlightRecorderHandler` left in the
+    given file and returns them as list of closed log records, oldest
+    record first.  The sequence number of each record is available as
+    ``record.extra['seq']``.
+    """
+    f = open(filename, 'rb')
+    try:
+        data = f.read()
+    finally:
+        f.close()
+    if len(data) < _flight_data_offset:
+        return []
+    magic, size, tail, head, seq = _flight_header.unpack_from(data, 0)
+    if magic != _flight_magic or \
+       len(data) != _flight_data_offset + size or \
+       not tail <= head <= tail + size:
+        raise ValueError('%r is not a flight recording' % filename)
+    records = []
+    while tail < head:
+        pos = tail % size
+        if size - pos < _flight_length.size:
+            tail += size - pos
+            continue
+        offset = _flight_data_offset + pos
+        length = _flight_length.unpack_from(data, offset)[0]
+        if length == 0:
+            tail += size - pos
+            continue
+        if length < _flight_entry.size or pos + length > size:
+            break
+        (length, seq, timestamp, level, process, channel_length,
+         message_length, exception_length) = \
+            _flight_entry.unpack_from(data, offset)
+        offset += _flight_entry.size
+        channel = data[offset:offset + channel_length]
+        offset += channel_length
+        message = data[offset:offset + message_length]
+        offset += message_length
+        exception = data[offset:offset + exception_length]
+        message = message.decode('utf-8', 'replace')
+        records.append(LogRecord.from_dict({
+            'channel':              channel.decode('utf-8', 'replace'),
+            'level':                level,
+            'msg':                  message,
+            'message':              message,
+            'args':                 (),
+            'kwargs':               {},
+            'time':                 datetime.utcfromtimestamp(timestamp),
+            'process':              process or None,
+            'formatted_exception':  exception.decode('utf-8', 'replace')
+                                    or None,
+            'extra':                {'seq': seq},
+            'heavy_initialized':    True,
+            'late':                 True
+        }))
+        tail += length
+    return records
+
+
 class TwitterFormatter(StringFormatter):
     """Works like the standard string formatter and is used by the
     :class:`TwitterHandler` unless changed.
@@ -8,12 +8,456 @@
     :copyright: (c) 2010 by Armin Ronacher, Georg Brandl.
     :license: BSD, see LICENSE for more details.
 """
-from threading import Thread
-from Queue import Empty, Queue as ThreadQueue
-from itertools import cycle
-from logbook.base import NOTSET, LogRecord, dispatch_record
+from __future__ import with_statement
+
+import os
+import re
+import sys
+import time
+import zlib
+import mmap
+import errno
+import select
+import stat
+import socket
+import traceback
+import heapq
+import struct
+from datetime import datetime, timedelta
+from threading import Thread, Lock, Condition, Event
+from Queue import Empty, Full, Queue as ThreadQueue
+from collections import deque
+from itertools import cycle, count, izip
+from logbook.base import NOTSET, LogRecord, FrozenRecord, ExtraDict, \
+     dispatch_record, dispatch_records, _create_frozen_record, _level_names, \
+     get_level_name, lookup_level
 from logbook.handlers import Handler
-from logbook.helpers import json
+from logbook.helpers import json, to_safe_json
+
+
+_epoch = datetime(1970, 1, 1)
+
+
+class JSONCodec(object):
+    """Encodes records as JSON exported dictionaries.  This is the default
+    codec and the format every subscriber understands.
+    """
+
+    #: `True` for codecs that remember what they encoded before.
+    stateful = False
+
+    def encode(self, record):
+        """Encodes a record into a string."""
+        return json.dumps(record.to_dict(json_safe=True))
+
+    def decode(self, data):
+        """Decodes a string into a log record."""
+        return LogRecord.from_dict(json.loads(data))
+
+
+class BinaryCodec(object):
+    """Encodes records in a compact binary format that is a lot faster to
+    decode than JSON.  Level, time, process, thread and line number are
+    packed into a fixed header followed by length prefixed UTF-8 strings.
+    The extra dictionary is stored as JSON.  Decoded records are
+    :class:`~logbook.FrozenRecord`\s.
+
+    By default all the information of the record is sent.  To save space
+    `fields` can be set to the names of the string fields that should be
+    sent (from :attr:`string_fields`), the channel and message are always
+    sent.
+    """
+
+    #: the first byte of an encoded record.  JSON encoded records start
+    #: with ``{`` which is how subscribers tell the formats apart.
+    tag = '\x01'
+
+    #: the string fields in the order they are sent.
+    string_fields = ('channel', 'msg', 'filename', 'func_name', 'module',
+                     'thread_name', 'process_name', 'formatted_exception',
+                     'exception_name', 'exception_message', 'extra')
+
+    # tag, level, mask of the present fields, time in microseconds since
+    # the epoch, process, thread and line number
+    _header = struct.Struct('<cBHqIQi')
+    _time_flag = 1 << len(string_fields)
+
+    def __init__(self, fields=None):
+        if fields is None:
+            fields = self.string_fields
+        self.fields = frozenset(fields) | frozenset(['channel', 'msg'])
+        self._length_structs = {}
+
+    def _lengths(self, n):
+        rv = self._length_structs.get(n)
+        if rv is None:
+            rv = self._length_structs[n] = struct.Struct('<%dI' % n)
+        return rv
+
+    def encode(self, record):
+        """Encodes a record into a string."""
+        mask = 0
+        lengths = []
+        strings = []
+        for bit, name in enumerate(self.string_fields):
+            if name not in self.fields:
+                continue
+            if name == 'msg':
+                value = record.message
+            elif name == 'extra':
+                value = record.extra and json.dumps(
+                    to_safe_json(dict(record.extra))) or None
+            else:
+                value = getattr(record, name)
+            if value is None:
+                continue
+            if isinstance(value, unicode):
+                value = value.encode('utf-8')
+            elif not isinstance(value, str):
+                value = str(value)
+            mask |= 1 << bit
+            length, value = self.encode_string(name, value)
+            lengths.append(length)
+            strings.append(value)
+        timestamp = 0
+        if record.time is not None:
+            mask |= self._time_flag
+            delta = record.time - _epoch
+            timestamp = (delta.days * 86400 + delta.seconds) * 1000000 + \
+                        delta.microseconds
+        lineno = record.lineno
+        if lineno is None:
+            lineno = -1
+        return self._header.pack(self.tag, record.level, mask, timestamp,
+                                 record.process or 0, record.thread or 0,
+                                 lineno) + \
+               self._lengths(len(lengths)).pack(*lengths) + ''.join(strings)
+
+    def encode_string(self, name, value):
+        """Returns the length field and the data that is sent for the value
+        of a string field (already encoded to UTF-8).  Subclasses can
+        override this.
+        """
+        return len(value), value
+
+    def decode_string(self, name, length, data, offset):
+        """Decodes the string at `offset` for the given length field.
+        Returns the string and the number of bytes it occupied.
+        """
+        return data[offset:offset + length].decode('utf-8', 'replace'), length
+
+    def decode(self, data, offset=0):
+        """Decodes a string into a :class:`~logbook.FrozenRecord`.  The
+        record starts at `offset`.
+        """
+        header = self._header
+        tag, level, mask, timestamp, process, thread, lineno = \
+            header.unpack_from(data, offset)
+        if tag != self.tag:
+            raise ValueError('not a binary encoded record')
+        values = dict.fromkeys(self.string_fields)
+        names = [name for bit, name in enumerate(self.string_fields)
+                 if mask & (1 << bit)]
+        lengths = self._lengths(len(names))
+        offset += header.size
+        sizes = lengths.unpack_from(data, offset)
+        offset += lengths.size
+        for name, length in izip(names, sizes):
+            values[name], length = self.decode_string(name, length, data,
+                                                      offset)
+            offset += length
+        extra = values['extra']
+        values['extra'] = extra and json.loads(extra) or {}
+        values['level'] = level
+        values['process'] = process or None
+        values['thread'] = thread or None
+        values['lineno'] = lineno >= 0 and lineno or None
+        values['time'] = None
+        if mask & self._time_flag:
+            values['time'] = _epoch + timedelta(0, timestamp // 1000000,
+                                                timestamp % 1000000)
+        return _create_frozen_record(FrozenRecord, [values[key] for key in
+                                                    FrozenRecord._fields])
+
+
+class InterningCodec(BinaryCodec):
+    """Works like the :class:`BinaryCodec` but sends strings that repeat
+    in almost every record (the channel, filename, function and module
+    names, the thread and process names, exception names and messages
+    without arguments) only once.  Afterwards records refer to them by a
+    number.
+
+    Because of that the receiving side has to see the records of a
+    handler in order and from the start of its string table.  Every
+    `reset_interval` records, and whenever the table holds more than
+    `max_strings` strings, the table is started over so that subscribers
+    that joined late (or lost records) can catch up.  Until then records
+    they cannot decode are dropped.  The records of a table are numbered
+    and a subscriber that misses one of them drops the rest of the table
+    as well instead of mixing up the strings.  Each handler needs its own
+    instance of this codec and subscribers keep one table per sending
+    handler.
+    """
+
+    tag = '\x02'
+    stateful = True
+
+    #: the string fields that are interned.
+    interned_fields = frozenset(['channel', 'msg', 'filename', 'func_name',
+                                 'module', 'thread_name', 'process_name',
+                                 'exception_name'])
+
+    # tag, id of the sending codec, number of the string table, number of
+    # the record in the table and flags
+    _prefix = struct.Struct('<c4sHIB')
+    _reset_flag = 1
+    # flags in the length field.  References carry the number of the
+    # string instead of a length, definitions get the next free number.
+    _reference_flag = 0x80000000
+    _definition_flag = 0x40000000
+    _length_mask = 0x3fffffff
+
+    #: the maximum number of senders a receiving codec keeps tables for.
+    max_sources = 1024
+
+    def __init__(self, fields=None, reset_interval=1000, max_strings=4096):
+        BinaryCodec.__init__(self, fields)
+        self.reset_interval = reset_interval
+        self.max_strings = max_strings
+        # sending side
+        self._pid = None
+        self._source = None
+        self._table = 0
+        self._strings = None
+        self._count = 0
+        self._intern_msg = False
+        # receiving side
+        self._sources = {}
+        self._current = None
+
+    def reset(self):
+        """Starts a new string table with the next record."""
+        self._strings = None
+
+    def copy(self):
+        """Returns a new codec with the same settings and its own string
+        table.
+        """
+        return self.__class__(self.fields, self.reset_interval,
+                              self.max_strings)
+
+    def encode(self, record):
+        """Encodes a record into a string."""
+        pid = os.getpid()
+        if pid != self._pid:
+            # a forked process must not continue the table of its parent
+            self._pid = pid
+            self._source = os.urandom(4)
+            self._strings = None
+        flags = 0
+        if self._strings is None or len(self._strings) >= self.max_strings \
+           or (self.reset_interval and self._count >= self.reset_interval):
+            self._strings = {}
+            self._table = (self._table + 1) & 0xffff
+            self._count = 0
+            flags |= self._reset_flag
+        number = self._count
+        self._count += 1
+        self._intern_msg = not (record.args or record.kwargs)
+        return self._prefix.pack(self.tag, self._source, self._table,
+                                 number, flags) \
+            + BinaryCodec.encode(self, record)
+
+    def encode_string(self, name, value):
+        if name not in self.interned_fields or \
+           (name == 'msg' and not self._intern_msg):
+            return len(value), value
+        id = self._strings.get(value)
+        if id is not None:
+            return self._reference_flag | id, ''
+        self._strings[value] = len(self._strings)
+        return self._definition_flag | len(value), value
+
+    def decode_string(self, name, length, data, offset):
+        if length & self._reference_flag:
+            return self._current[length & self._length_mask], 0
+        if length & self._definition_flag:
+            length &= self._length_mask
+            rv = data[offset:offset + length].decode('utf-8', 'replace')
+            self._current.append(rv)
+            return rv, length
+        return data[offset:offset + length].decode('utf-8', 'replace'), length
+
+    def decode(self, data, offset=0):
+        """Decodes a string into a :class:`~logbook.FrozenRecord`.  Returns
+        `None` if the record refers to strings that were not seen.
+        """
+        tag, source, table, number, flags = \
+            self._prefix.unpack_from(data, offset)
+        if tag != self.tag:
+            raise ValueError('not an interning encoded record')
+        if flags & self._reset_flag:
+            if source not in self._sources and \
+               len(self._sources) >= self.max_sources:
+                self._sources.popitem()
+            # table number, strings and the number of the next record
+            state = self._sources[source] = [table, [], number]
+        else:
+            state = self._sources.get(source)
+            if state is None or state[0] != table:
+                return None
+            if state[2] != number:
+                # a record got lost and with it maybe definitions, the
+                # numbers of later definitions would be off.  Wait for
+                # the next table.
+                del self._sources[source]
+                return None
+        self._current = state[1]
+        try:
+            rv = BinaryCodec.decode(self, data, offset + self._prefix.size)
+        except IndexError:
+            del self._sources[source]
+            return None
+        state[2] = number + 1
+        return rv
+
+
+_default_codec = JSONCodec()
+_codecs_by_tag = {'{': _default_codec, BinaryCodec.tag: BinaryCodec()}
+
+
+def decode_record(data):
+    """Decodes a record encoded by any of the stateless builtin codecs.
+    The codec is detected from the first byte.  To decode records of the
+    :class:`InterningCodec` use a :class:`RecordDecoder`.
+    """
+    codec = _codecs_by_tag.get(data[:1])
+    if codec is None:
+        raise ValueError('unknown record encoding')
+    return codec.decode(data)
+
+
+_batch_tag = '\x03'
+_batch_compressed = 1
+_batch_header = struct.Struct('<cB')
+_batch_length = struct.Struct('<I')
+
+
+def encode_batch(items, compress=False):
+    """Packs a list of encoded records into one string.  Optionally the
+    records are compressed with zlib.
+    """
+    data = ''.join([_batch_length.pack(len(item)) + item for item in items])
+    flags = 0
+    if compress:
+        data = zlib.compress(data)
+        flags |= _batch_compressed
+    return _batch_header.pack(_batch_tag, flags) + data
+
+
+def decode_batch(data):
+    """Unpacks a string created by :func:`encode_batch` into the list of
+    encoded records.
+    """
+    tag, flags = _batch_header.unpack_from(data)
+    if tag != _batch_tag:
+        raise ValueError('not a batch of records')
+    data = data[_batch_header.size:]
+    if flags & _batch_compressed:
+        data = zlib.decompress(data)
+    rv = []
+    offset = 0
+    while offset < len(data):
+        length = _batch_length.unpack_from(data, offset)[0]
+        offset += _batch_length.size
+        rv.append(data[offset:offset + length])
+        offset += length
+    return rv
+
+
+class RecordDecoder(object):
+    """Decodes records of all the builtin codecs and keeps the string
+    tables for records of the :class:`InterningCodec`.  Each subscriber
+    has its own decoder.
+    """
+
+    def __init__(self):
+        self._interning = InterningCodec()
+
+    def decode(self, data):
+        """Decodes a record.  Returns `None` if the record cannot be
+        decoded yet (see :class:`InterningCodec`).
+        """
+        if data[:1] == InterningCodec.tag:
+            return self._interning.decode(data)
+        return decode_record(data)
+
+    def decode_many(self, data):
+        """Decodes a single record or a batch of records (see
+        :func:`encode_batch`) and returns a list of records.  Records
+        that cannot be decoded yet are left out.
+        """
+        if data[:1] == _batch_tag:
+            items = decode_batch(data)
+        else:
+            items = [data]
+        return [record for record in map(self.decode, items)
+                if record is not None]
+
+
+_sequence = count(1)
+_source_id = (None, None)
+
+
+def get_source_id():
+    """Returns the id of this process that :func:`stamp_record` puts on
+    records.  It is made of the host name and the process id.
+    """
+    global _source_id
+    pid = os.getpid()
+    if _source_id[0] != pid:
+        _source_id = (pid, u'%s:%d' % (socket.gethostname(), pid))
+    return _source_id[1]
+
+
+def stamp_record(record, safe_extra=False):
+    """Returns a :class:`~logbook.FrozenRecord` of a record that leaves the
+    process, stamped with a sequence number that increases with every
+    stamped record of this process and the id of this process (see
+    :func:`get_source_id`).  They are stored as
+    ``extra['_logbook_seq']`` and ``extra['_logbook_source']`` of the
+    frozen record and allow the receiving side to tell where records came
+    from and to put them back into order.  The record itself is not
+    changed, so other handlers do not see the stamps.  Records that are
+    already stamped (because they were received from another process and
+    are sent on) keep their stamps.  `safe_extra` works like for
+    :meth:`~logbook.FrozenRecord.from_record`.
+    """
+    rv = FrozenRecord.from_record(record, safe_extra)
+    if '_logbook_seq' in rv.extra:
+        return rv
+    if rv is record:
+        # frozen records share their extra dictionary with the sender
+        values = [getattr(record, key) for key in FrozenRecord._fields]
+        values[-1] = ExtraDict(record.extra)
+        rv = _create_frozen_record(type(record), values)
+    rv.extra['_logbook_seq'] = _sequence.next()
+    rv.extra['_logbook_source'] = get_source_id()
+    return rv
+
+
+def make_topic(level, channel=None):
+    """Returns the ZeroMQ topic for records of the given level and channel
+    as the :class:`ZeroMQHandler` sends it with `topics` enabled.  If the
+    channel is `None`, the returned topic is a prefix of the topics of all
+    channels.
+    """
+    rv = '%s:' % get_level_name(level)
+    if channel is not None:
+        if isinstance(channel, unicode):
+            channel = channel.encode('utf-8')
+        rv += channel + '\x00'
+    return rv
 
 
 class ZeroMQHandler(Handler):
@@ -22,36 +466,123 @@ class ZeroMQHandler(Handler):
 
     The queue will be filled with JSON exported log records.  To receive such
     log records from a queue you can use the :class:`ZeroMQSubscriber`.
+    For a more compact and faster format pass a :class:`BinaryCodec` as
+    `codec`, the subscriber detects the format on its own.
 
 
     Example setup::
 
         handler = ZeroMQHandler('tcp://127.0.0.1:5000')
+
+    To send fewer and larger messages, records can be sent in batches.  A
+    batch is sent once it has `batch_size` records, and if `batch_interval`
+    is given, at the latest that many seconds after the last batch went
+    out (checked from a background thread).  With `compress` the batches
+    are compressed with zlib.  Records still waiting for their batch are
+    sent on :meth:`flush` and :meth:`close`.  The subscriber unpacks the
+    batches on its own.
+
+    If `topics` is `True`, each message is sent with the level and channel
+    of its records as ZeroMQ topic (see :func:`make_topic`) so that
+    subscribers can let ZeroMQ filter the records
+    (see :class:`ZeroMQSubscriber`).  `topics` can also be a function that
+    returns the topic for a record.  Batches only contain records of the
+    same topic and stateful codecs keep separate state for each topic.
     """
 
     def __init__(self, uri=None, level=NOTSET, filter=None, bubble=False,
-                 context=None):
+                 context=None, codec=None, batch_size=1, batch_interval=None,
+                 compress=False, topics=False):
         Handler.__init__(self, level, filter, bubble)
         try:
             import zmq
         except ImportError:
             raise RuntimeError('The pyzmq library is required for '
                                'the ZeroMQHandler.')
+        #: the codec that encodes the records (:class:`JSONCodec` by
+        #: default)
+        self.codec = codec or _default_codec
+        self.lock = Lock()
         #: the zero mq context
         self.context = context or zmq.Context()
         #: the zero mq socket.
         self.socket = self.context.socket(zmq.PUB)
         if uri is not None:
             self.socket.bind(uri)
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.compress = compress
+        if topics is True:
+            topics = lambda record: make_topic(record.level, record.channel)
+        self.topics = topics or None
+        # the records waiting for their batch by topic
+        self._batches = {}
+        self._topic_codecs = {}
+        self._flusher = None
+        if batch_size > 1 and batch_interval:
+            self._flusher_stopped = Event()
+            self._flusher = Thread(target=self._flush_periodically)
+            self._flusher.setDaemon(True)
+            self._flusher.start()
 
     def export_record(self, record):
-        """Exports the record into a dictionary ready for JSON dumping."""
+        """Exports the record into a dictionary ready for JSON dumping.
+        This is used if the records are sent with the :class:`JSONCodec`.
+        """
         return record.to_dict(json_safe=True)
 
+    def _flush_periodically(self):
+        while 1:
+            self._flusher_stopped.wait(self.batch_interval)
+            if self._flusher_stopped.isSet():
+                break
+            self.flush()
+
+    def _send(self, topic, data):
+        if topic is None:
+            self.socket.send(data)
+        else:
+            self.socket.send_multipart([topic, data])
+
+    def _send_batch(self, topic):
+        self._send(topic, encode_batch(self._batches.pop(topic),
+                                       self.compress))
+
+    def flush(self):
+        """Sends the records that wait for their batch."""
+        with self.lock:
+            for topic in self._batches.keys():
+                self._send_batch(topic)
+
     def emit(self, record):
-        self.socket.send(json.dumps(self.export_record(record)))
+        record = stamp_record(record)
+        with self.lock:
+            topic = None
+            codec = self.codec
+            if self.topics is not None:
+                topic = self.topics(record)
+                if codec.stateful:
+                    codec = self._topic_codecs.get(topic)
+                    if codec is None:
+                        codec = self._topic_codecs[topic] = self.codec.copy()
+            if type(codec) is JSONCodec:
+                data = json.dumps(self.export_record(record))
+            else:
+                data = codec.encode(record)
+            if self.batch_size > 1:
+                batch = self._batches.setdefault(topic, [])
+                batch.append(data)
+                if len(batch) >= self.batch_size:
+                    self._send_batch(topic)
+            else:
+                self._send(topic, data)
 
     def close(self):
+        if self._flusher is not None:
+            self._flusher_stopped.set()
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
         self.socket.close()
 
 
@@ -60,17 +591,32 @@ class ThreadController(object):
     thread.  This is usually created and started in one go by
     :meth:`~logbook.queues.ZeroMQSubscriber.dispatch_in_background` or
     a comparable function.
+
+    If the subscriber has a file descriptor (:meth:`SubscriberBase.fileno`)
+    the thread sleeps in :func:`select.select` until records arrive or the
+    controller is stopped.  Otherwise it waits in the subscriber's
+    :meth:`~SubscriberBase.recv` for up to :attr:`fallback_timeout`
+    seconds at a time, which is how long :meth:`stop` might take.
+
+    Before waiting on the file descriptor the records are received until
+    nothing is available anymore because the descriptors of some
+    subscribers (ZeroMQ) only signal the arrival of new messages.
     """
 
+    #: the timeout for subscribers without a file descriptor.
+    fallback_timeout = 0.5
+
     def __init__(self, subscriber, setup=None):
         self.setup = setup
         self.subscriber = subscriber
         self.running = False
         self._thread = None
+        self._wakeup = None
 
     def start(self):
         """Starts the task thread."""
         self.running = True
+        self._wakeup = os.pipe()
         self._thread = Thread(target=self._target)
         self._thread.setDaemon(True)
         self._thread.start()
@@ -79,15 +625,41 @@ class ThreadController(object):
         """Stops the task thread."""
         if self.running:
             self.running = False
+            os.write(self._wakeup[1], 'x')
             self._thread.join()
             self._thread = None
+            for fd in self._wakeup:
+                os.close(fd)
+            self._wakeup = None
+
+    def handle_once(self, timeout):
+        """Receives and handles the available records.  Returns `True` if
+        there were any.
+        """
+        return self.subscriber.dispatch_batch(timeout=timeout) > 0
+
+    def _run(self):
+        fd = self.subscriber.fileno()
+        wakeup = self._wakeup[0]
+        while self.running:
+            if fd is None:
+                self.handle_once(self.fallback_timeout)
+                continue
+            # the file descriptors of some subscribers (ZeroMQ) only
+            # signal new records, so everything available is handled
+            # before waiting again.  Subscribers skip the messages they
+            # cannot decode, so nothing is left when this stops.
+            while self.running and self.handle_once(0):
+                pass
+            if self.running and \
+               wakeup in select.select([fd, wakeup], [], [])[0]:
+                break
 
     def _target(self):
         if self.setup is not None:
             self.setup.push_thread()
         try:
-            while self.running:
-                self.subscriber.dispatch_once(timeout=0.05)
+            self._run()
         finally:
             if self.setup is not None:
                 self.setup.pop_thread()
@@ -101,10 +673,37 @@ class SubscriberBase(object):
         `None` means blocking and otherwise it's a timeout in seconds after which
         the function just returns with `None`.
 
-        Subclasses have to override this.
+        Subclasses have to override this.  Messages that cannot be decoded
+        have to be skipped, `None` means that no record is available.
         """
         raise NotImplementedError()
 
+    def fileno(self):
+        """Returns a file descriptor that becomes readable when records
+        arrive or `None` if the subscriber does not have one.  After the
+        descriptor became readable, :meth:`recv` has to be called with a
+        timeout of 0 until it returns `None` because some subscribers only
+        signal the arrival of new records.
+        """
+        return None
+
+    def recv_many(self, max_records=100, timeout=None):
+        """Receives up to `max_records` records.  The timeout works like for
+        :meth:`recv` but only applies to the first record, after that only
+        the records that are already available are received.  Returns a
+        list of records which is empty if the call timed out.
+        """
+        rv = self.recv(timeout)
+        if rv is None:
+            return []
+        records = [rv]
+        while len(records) < max_records:
+            rv = self.recv(0)
+            if rv is None:
+                break
+            records.append(rv)
+        return records
+
     def dispatch_once(self, timeout=None):
         """Receives one record from the socket, loads it and dispatches it.  Returns
         `True` if something was dispatched or `False` if it timed out.
@@ -115,10 +714,20 @@ class SubscriberBase(object):
             return True
         return False
 
+    def dispatch_batch(self, max_records=100, timeout=None):
+        """Receives up to `max_records` records with :meth:`recv_many` and
+        dispatches them with :func:`~logbook.base.dispatch_records`.
+        Returns the number of dispatched records.
+        """
+        records = self.recv_many(max_records, timeout)
+        if records:
+            dispatch_records(records)
+        return len(records)
+
     def dispatch_forever(self):
         """Starts a loop that dispatches log records forever."""
         while 1:
-            self.dispatch_once()
+            self.dispatch_batch()
 
     def dispatch_in_background(self, setup=None):
         """Starts a new daemonized thread that dispatches in the background.
@@ -161,9 +770,19 @@ class ZeroMQSubscriber(SubscriberBase):
     thread::
 
         controller.stop()
+
+    If the handler sends topics, the subscriber can limit the records it
+    receives to a minimum `level` and a list of `channels`.  The filtering
+    happens in ZeroMQ before the records are decoded::
+
+        subscriber = ZeroMQSubscriber('tcp://127.0.0.1:5000',
+                                      level='ERROR', channels=['app'])
+
+    Without `level` and `channels` the subscriber receives all records
+    whether they are sent with topics or not.
     """
 
-    def __init__(self, uri=None, context=None):
+    def __init__(self, uri=None, context=None, level=NOTSET, channels=None):
         try:
             import zmq
         except ImportError:
@@ -177,7 +796,18 @@ class ZeroMQSubscriber(SubscriberBase):
         self.socket = self.context.socket(zmq.SUB)
         if uri is not None:
             self.socket.connect(uri)
-        self.socket.setsockopt(zmq.SUBSCRIBE, '')
+        level = lookup_level(level)
+        if level == NOTSET and not channels:
+            self.socket.setsockopt(zmq.SUBSCRIBE, '')
+        else:
+            for value in _level_names:
+                if value >= level and value != NOTSET:
+                    for channel in channels or (None,):
+                        self.socket.setsockopt(zmq.SUBSCRIBE,
+                                               make_topic(value, channel))
+        self._decoder = RecordDecoder()
+        # records of a batch that were not returned yet
+        self._pending = deque()
 
     def __del__(self):
         self.close()
@@ -186,22 +816,39 @@ class ZeroMQSubscriber(SubscriberBase):
         """Closes the zero mq socket."""
         self.socket.close()
 
+    def fileno(self):
+        return self.socket.getsockopt(self._zmq.FD)
+
     def recv(self, timeout=None):
         """Receives a single record from the socket.  Timeout of 0 means nonblocking,
         `None` means blocking and otherwise it's a timeout in seconds after which
         the function just returns with `None`.
+
+        Messages that cannot be decoded (yet) are skipped, so `None` is
+        only returned if no record arrived in time.
         """
-        if timeout is None:
-            rv = self.socket.recv()
-        elif not timeout:
-            rv = self.socket.recv(self._zmq.NOBLOCK)
-            if rv is None:
-                return
-        else:
-            if not self._zmq.select([self.socket], [], [], timeout)[0]:
-                return
-            rv = self.socket.recv(self._zmq.NOBLOCK)
-        return LogRecord.from_dict(json.loads(rv))
+        if timeout:
+            deadline = time.time() + timeout
+        while not self._pending:
+            if timeout is None:
+                rv = self.socket.recv_multipart()
+            else:
+                if timeout:
+                    remaining = deadline - time.time()
+                    if remaining <= 0 or not self._zmq.select(
+                            [self.socket], [], [], remaining)[0]:
+                        return None
+                try:
+                    rv = self.socket.recv_multipart(self._zmq.NOBLOCK)
+                except self._zmq.ZMQError, e:
+                    if e.errno != self._zmq.EAGAIN:
+                        raise
+                    if not timeout:
+                        return None
+                    continue
+            # the last frame is the payload, a topic might come before
+            self._pending.extend(self._decoder.decode_many(rv[-1]))
+        return self._pending.popleft()
 
 
 def _fix_261_mplog():
@@ -225,15 +872,28 @@ class MultiProcessingHandler(Handler):
         queue = Queue(-1)
         handler = MultiProcessingHandler(queue)
 
+    By default :class:`~logbook.FrozenRecord`\s are pickled into the queue.
+    If a `codec` is given, the encoded strings are put into the queue
+    instead.
     """
 
-    def __init__(self, queue, level=NOTSET, filter=None, bubble=False):
+    def __init__(self, queue, level=NOTSET, filter=None, bubble=False,
+                 codec=None):
         Handler.__init__(self, level, filter, bubble)
         self.queue = queue
+        self.codec = codec
+        self.lock = Lock()
         _fix_261_mplog()
 
     def emit(self, record):
-        self.queue.put_nowait(record.to_dict(json_safe=True))
+        if self.codec is not None:
+            record = stamp_record(record)
+            # stateful codecs need the records in the queue in the order
+            # they were encoded.
+            with self.lock:
+                self.queue.put_nowait(self.codec.encode(record))
+        else:
+            self.queue.put_nowait(stamp_record(record, safe_extra=True))
 
 
 class MultiProcessingSubscriber(SubscriberBase):
@@ -280,17 +940,612 @@ class MultiProcessingSubscriber(SubscriberBase):
             from multiprocessing import Queue
             queue = Queue(-1)
         self.queue = queue
+        self._decoder = RecordDecoder()
         _fix_261_mplog()
 
+    def fileno(self):
+        # the reading end of the pipe behind the queue
+        reader = getattr(self.queue, '_reader', None)
+        if reader is not None:
+            return reader.fileno()
+
     def recv(self, timeout=None):
-        if timeout is None:
-            rv = self.queue.get()
-        else:
+        if timeout:
+            deadline = time.time() + timeout
+        while 1:
             try:
-                rv = self.queue.get(block=False, timeout=timeout)
+                if timeout is None:
+                    rv = self.queue.get()
+                elif not timeout:
+                    rv = self.queue.get(block=False)
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return None
+                    rv = self.queue.get(timeout=remaining)
             except Empty:
                 return None
-        return LogRecord.from_dict(rv)
+            if isinstance(rv, str):
+                rv = self._decoder.decode(rv)
+            # older handlers put dictionaries into the queue
+            elif isinstance(rv, dict):
+                rv = LogRecord.from_dict(rv)
+            if rv is not None:
+                return rv
+
+
+# the shared memory ring starts with a header (magic and size of the ring)
+# followed by the absolute write position of the producer, the absolute
+# read position of the consumer and the flag of the sleeping consumer,
+# each in its own cache line.  Each entry is the length of the encoded
+# record followed by the record, a length of zero marks the wrap around.
+_ring_header = struct.Struct('<8sI')
+_ring_magic = 'LBSHMRNG'
+_ring_position = struct.Struct('<Q')
+_ring_flag = struct.Struct('<I')
+_ring_head_offset = 64
+_ring_tail_offset = 128
+_ring_waiting_offset = 192
+_ring_data_offset = 256
+_ring_length = struct.Struct('<I')
+
+
+def _open_ring(filename):
+    """Maps the ring buffer a :class:`SharedMemorySubscriber` created and
+    returns the mapping and the size of the ring.
+    """
+    fd = os.open(filename, os.O_RDWR)
+    try:
+        total = os.fstat(fd).st_size
+        buffer = mmap.mmap(fd, total)
+    finally:
+        os.close(fd)
+    magic, size = _ring_header.unpack_from(buffer, 0)
+    if magic != _ring_magic or total != _ring_data_offset + size:
+        buffer.close()
+        raise ValueError('%r is not a shared memory ring' % filename)
+    return buffer, size
+
+
+class SharedMemoryHandler(Handler):
+    """Sends records to a :class:`SharedMemorySubscriber` in another
+    process on the same machine through a ring buffer in a memory mapped
+    file.  Sending a record encodes it and copies it into the mapping, a
+    system call only happens if the subscriber is waiting for records, in
+    which case it is woken up through a named pipe next to the file
+    (``filename + '.fifo'``).
+
+    The subscriber creates the ring buffer, so it has to be set up before
+    the handler::
+
+        subscriber = SharedMemorySubscriber('/tmp/app-worker-1.ring')
+        ...
+        handler = SharedMemoryHandler('/tmp/app-worker-1.ring')
+
+    The ring buffer has a single producer.  One handler can be used by
+    many threads of a process, but each process needs its own ring buffer
+    (and a handler created after forking).  A handler that was inherited
+    by a forked process drops the records of that process instead of
+    corrupting the ring of its parent.  Use a :class:`SubscriberGroup` to
+    receive from the rings of all processes.
+
+    If the ring buffer is full because the subscriber cannot keep up, the
+    record is dropped instead of blocking the application and counted in
+    :attr:`dropped`.  The records are encoded with `codec` which defaults
+    to the :class:`BinaryCodec`.
+    """
+
+    def __init__(self, filename, level=NOTSET, filter=None, bubble=False,
+                 codec=None):
+        Handler.__init__(self, level, filter, bubble)
+        if codec is None:
+            codec = BinaryCodec()
+        self.codec = codec
+        self.lock = Lock()
+        #: the number of records that were dropped because the ring
+        #: buffer was full (or the handler was used after forking).
+        self.dropped = 0
+        self._pid = os.getpid()
+        self._buffer, self._size = _open_ring(filename)
+        self._head = _ring_position.unpack_from(self._buffer,
+                                                _ring_head_offset)[0]
+        self._wakeup = os.open(filename + '.fifo',
+                               os.O_WRONLY | os.O_NONBLOCK)
+
+    def close(self):
+        with self.lock:
+            if self._buffer is not None:
+                self._buffer.close()
+                self._buffer = None
+                os.close(self._wakeup)
+
+    def _append(self, data):
+        buffer = self._buffer
+        size = self._size
+        head = self._head
+        tail = _ring_position.unpack_from(buffer, _ring_tail_offset)[0]
+        pos = head % size
+        needed = _ring_length.size + len(data)
+        skip = 0
+        if pos + needed > size:
+            skip = size - pos
+        if head + skip + needed - tail > size:
+            self.dropped += 1
+            return
+        if skip:
+            if skip >= _ring_length.size:
+                _ring_length.pack_into(buffer, _ring_data_offset + pos, 0)
+            pos = 0
+        offset = _ring_data_offset + pos
+        _ring_length.pack_into(buffer, offset, len(data))
+        offset += _ring_length.size
+        buffer[offset:offset + len(data)] = data
+        # the entry has to be complete before the subscriber can see it
+        self._head = head + skip + needed
+        _ring_position.pack_into(buffer, _ring_head_offset, self._head)
+        if _ring_flag.unpack_from(buffer, _ring_waiting_offset)[0]:
+            _ring_flag.pack_into(buffer, _ring_waiting_offset, 0)
+            try:
+                os.write(self._wakeup, 'x')
+            except OSError, e:
+                # the pipe is full of wakeups already
+                if e.errno != errno.EAGAIN:
+                    raise
+
+    def emit(self, record):
+        if os.getpid() != self._pid:
+            # the ring buffer belongs to the parent process
+            with self.lock:
+                self.dropped += 1
+            return
+        record = stamp_record(record)
+        if getattr(self.codec, 'stateful', False):
+            with self.lock:
+                if self._buffer is not None:
+                    self._append(self.codec.encode(record))
+            return
+        data = self.codec.encode(record)
+        with self.lock:
+            if self._buffer is not None:
+                self._append(data)
+
+
+class SharedMemorySubscriber(SubscriberBase):
+    """Receives the records of a :class:`SharedMemoryHandler` from a ring
+    buffer in a memory mapped file and dispatches them to the active
+    handler setup.  The subscriber creates (or clears) the file and a named
+    pipe next to it (``filename + '.fifo'``), the handler only opens them.
+
+    `size` is the size of the ring buffer in bytes.  The subscriber
+    supports :meth:`fileno`, so it can be used with :class:`SubscriberGroup`
+    and :meth:`dispatch_in_background` waits without polling.
+    """
+
+    def __init__(self, filename, size=4 * 1024 * 1024):
+        fifo = filename + '.fifo'
+        try:
+            os.mkfifo(fifo, 0600)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0600)
+        try:
+            os.ftruncate(fd, _ring_data_offset + size)
+            self._buffer = mmap.mmap(fd, _ring_data_offset + size)
+        finally:
+            os.close(fd)
+        self._size = size
+        self._tail = 0
+        _ring_position.pack_into(self._buffer, _ring_head_offset, 0)
+        _ring_position.pack_into(self._buffer, _ring_tail_offset, 0)
+        _ring_flag.pack_into(self._buffer, _ring_waiting_offset, 0)
+        _ring_header.pack_into(self._buffer, 0, _ring_magic, size)
+        self._wakeup = os.open(fifo, os.O_RDONLY | os.O_NONBLOCK)
+        # without a writer the pipe would signal the end of the file all
+        # the time, so the subscriber keeps one open itself.
+        self._wakeup_writer = os.open(fifo, os.O_WRONLY | os.O_NONBLOCK)
+        self._decoder = RecordDecoder()
+
+    def close(self):
+        """Closes the ring buffer."""
+        if self._buffer is not None:
+            self._buffer.close()
+            self._buffer = None
+            os.close(self._wakeup)
+            os.close(self._wakeup_writer)
+
+    def fileno(self):
+        return self._wakeup
+
+    def _pop(self):
+        buffer = self._buffer
+        size = self._size
+        head = _ring_position.unpack_from(buffer, _ring_head_offset)[0]
+        while self._tail < head:
+            pos = self._tail % size
+            if size - pos >= _ring_length.size:
+                offset = _ring_data_offset + pos
+                length = _ring_length.unpack_from(buffer, offset)[0]
+                if length:
+                    offset += _ring_length.size
+                    data = buffer[offset:offset + length]
+                    self._tail += _ring_length.size + length
+                    _ring_position.pack_into(buffer, _ring_tail_offset,
+                                             self._tail)
+                    return data
+            self._tail += size - pos
+
+    def _wait(self, timeout):
+        """Announces that the subscriber is going to sleep and returns
+        `True` if the ring buffer is still empty.  If `timeout` is not 0
+        it then waits for the producer to wake it up.
+        """
+        try:
+            while os.read(self._wakeup, 512):
+                pass
+        except OSError, e:
+            if e.errno != errno.EAGAIN:
+                raise
+        _ring_flag.pack_into(self._buffer, _ring_waiting_offset, 1)
+        head = _ring_position.unpack_from(self._buffer, _ring_head_offset)[0]
+        if head != self._tail:
+            return False
+        if timeout != 0:
+            select.select([self._wakeup], [], [], timeout)
+        return True
+
+    def recv(self, timeout=None):
+        if timeout:
+            deadline = time.time() + timeout
+        while 1:
+            data = self._pop()
+            if data is not None:
+                rv = self._decoder.decode(data)
+                if rv is not None:
+                    return rv
+                continue
+            if timeout == 0:
+                if self._wait(0):
+                    return None
+            elif timeout is None:
+                self._wait(None)
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self._wait(remaining)
+
+
+# records on stream sockets are prefixed with their length
+_frame_length = struct.Struct('>I')
+_max_frame_size = 64 * 1024 * 1024
+
+
+def _make_socket(address):
+    """Returns an unconnected stream socket for the address.  Strings are
+    paths of Unix domain sockets, tuples are TCP addresses.
+    """
+    if isinstance(address, basestring):
+        return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    family = socket.getaddrinfo(address[0], address[1], 0,
+                                socket.SOCK_STREAM)[0][0]
+    return socket.socket(family, socket.SOCK_STREAM)
+
+
+def _listen(address, backlog):
+    """Returns a non-blocking socket listening on the address.  An
+    existing Unix domain socket file is replaced.
+    """
+    if isinstance(address, basestring):
+        try:
+            if stat.S_ISSOCK(os.stat(address).st_mode):
+                os.unlink(address)
+        except OSError:
+            pass
+    sock = _make_socket(address)
+    if sock.family != socket.AF_UNIX:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(address)
+    sock.listen(backlog)
+    sock.setblocking(0)
+    return sock
+
+
+def split_frames(data):
+    """Splits the length prefixed records at the start of `data` (as sent
+    by the :class:`SocketHandler`) off and returns them as a list together
+    with the incomplete rest of the data.  Raises a :exc:`ValueError` for
+    frames that are too large to be records.
+    """
+    frames = []
+    offset = 0
+    while len(data) - offset >= _frame_length.size:
+        length = _frame_length.unpack_from(data, offset)[0]
+        if length > _max_frame_size:
+            raise ValueError('frame of %d bytes is too large' % length)
+        end = offset + _frame_length.size + length
+        if end > len(data):
+            break
+        frames.append(data[offset + _frame_length.size:end])
+        offset = end
+    return frames, data[offset:]
+
+
+class SocketHandler(Handler):
+    """Sends records over a TCP or Unix domain stream socket to a
+    :class:`SocketSubscriber` or a :class:`~logbook.collector.Collector`.
+    This does not require any library.  `address` is either a
+    ``(host, port)`` tuple or the path of a Unix domain socket::
+
+        handler = SocketHandler(('127.0.0.1', 5170))
+        handler = SocketHandler('/var/run/app/logs.sock')
+
+    Each record is encoded with `codec` (the :class:`BinaryCodec` by
+    default) and prefixed with its length.  The records are handed to a
+    background thread which sends everything that accumulated in the
+    meantime with one call, so the logging thread never waits for the
+    network.  If the connection cannot be established or breaks, the
+    thread reconnects, waiting twice as long after every failed attempt
+    up to `max_backoff` seconds.  Meanwhile the records are kept in
+    memory, up to `max_buffer` bytes.  Records that do not fit are
+    dropped and counted in :attr:`dropped`, or if `overflow` is
+    ``'raise'``, :meth:`emit` raises :exc:`Queue.Full` for them.  This is
+    what the :class:`SpoolingHandler` needs to spool the records to disk.
+
+    A record is removed from the buffer once it was handed to the
+    operating system completely.  A record that was sent partially when
+    the connection broke is sent again as a whole over the new
+    connection, the receiving side discards the incomplete copy.  Records
+    that were in flight when the connection broke can be lost, but no
+    record is received twice.
+
+    On :meth:`close` the records that are still buffered are sent if the
+    connection works, otherwise they are lost.  Records emitted after
+    :meth:`close` are counted in :attr:`dropped`.
+    """
+
+    def __init__(self, address, level=NOTSET, filter=None, bubble=False,
+                 codec=None, max_buffer=4 * 1024 * 1024, max_backoff=30,
+                 timeout=10, overflow='drop'):
+        Handler.__init__(self, level, filter, bubble)
+        if overflow not in ('drop', 'raise'):
+            raise ValueError('unknown overflow policy %r' % overflow)
+        self.address = address
+        self.overflow = overflow
+        if codec is None:
+            codec = BinaryCodec()
+        self.codec = codec
+        self.max_buffer = max_buffer
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        #: the number of records that were dropped because the buffer
+        #: was full or the handler was closed.
+        self.dropped = 0
+        self.lock = Lock()
+        self._ready = Condition(self.lock)
+        self._frames = []
+        self._buffered = 0
+        self._closing = False
+        self._socket = None
+        self._sender = None
+        self._pid = None
+
+    def _connect(self):
+        sock = _make_socket(self.address)
+        try:
+            sock.settimeout(self.timeout)
+            sock.connect(self.address)
+            if sock.family != socket.AF_UNIX:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except socket.error:
+            sock.close()
+            raise
+        return sock
+
+    def _disconnect(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def _remove_sent(self, frames, sent):
+        """Removes the frames that were sent completely from the buffer."""
+        count = size = 0
+        for frame in frames:
+            if size + len(frame) > sent:
+                break
+            size += len(frame)
+            count += 1
+        del self._frames[:count]
+        self._buffered -= size
+
+    def _send_forever(self):
+        backoff = 0
+        while 1:
+            with self.lock:
+                while not self._frames and not self._closing:
+                    self._ready.wait()
+                if not self._frames:
+                    break
+                frames = list(self._frames)
+            data = ''.join(frames)
+            sent = 0
+            try:
+                if self._socket is None:
+                    self._socket = self._connect()
+                while sent < len(data):
+                    sent += self._socket.send(buffer(data, sent))
+            except socket.error:
+                self._disconnect()
+                with self.lock:
+                    self._remove_sent(frames, sent)
+                    if self._closing:
+                        break
+                    backoff = min(max(backoff * 2, 0.1), self.max_backoff)
+                    self._ready.wait(backoff)
+                continue
+            backoff = 0
+            with self.lock:
+                self._remove_sent(frames, sent)
+        self._disconnect()
+
+    def _start_sender(self):
+        pid = os.getpid()
+        if pid != self._pid:
+            # a forked process has neither the thread nor its own
+            # connection and must not send the records of the parent.
+            self._pid = pid
+            self._socket = None
+            self._frames = []
+            self._buffered = 0
+            self._sender = Thread(target=self._send_forever)
+            self._sender.setDaemon(True)
+            self._sender.start()
+
+    def emit(self, record):
+        record = stamp_record(record)
+        if getattr(self.codec, 'stateful', False):
+            with self.lock:
+                self._enqueue(self.codec.encode(record))
+        else:
+            data = self.codec.encode(record)
+            with self.lock:
+                self._enqueue(data)
+
+    def _enqueue(self, data):
+        if self._closing:
+            self.dropped += 1
+            return
+        self._start_sender()
+        frame = _frame_length.pack(len(data)) + data
+        if self._buffered + len(frame) > self.max_buffer:
+            if self.overflow == 'raise':
+                raise Full('the send buffer is full')
+            self.dropped += 1
+            return
+        self._frames.append(frame)
+        self._buffered += len(frame)
+        self._ready.notify()
+
+    def close(self):
+        with self.lock:
+            self._closing = True
+            self._ready.notify()
+            sender = self._sender
+            self._sender = None
+        if sender is not None and self._pid == os.getpid():
+            sender.join()
+
+
+class SocketSubscriber(SubscriberBase):
+    """Listens on a TCP or Unix domain stream socket for connections of
+    :class:`SocketHandler`\s and receives their records.  `address` is
+    either a ``(host, port)`` tuple or the path of a Unix domain socket
+    (an existing socket file is replaced).  Any number of handlers can be
+    connected at the same time::
+
+        subscriber = SocketSubscriber(('127.0.0.1', 5170))
+        with target_handler:
+            subscriber.dispatch_forever()
+
+    The address the subscriber actually listens on (useful with port 0)
+    is available as :attr:`address`.  On Linux the subscriber supports
+    :meth:`fileno` through an epoll object.
+    """
+
+    def __init__(self, address, backlog=128):
+        self.socket = _listen(address, backlog)
+        #: the address the subscriber listens on.
+        self.address = self.socket.getsockname()
+        # connections and their incomplete data by file descriptor
+        self._connections = {}
+        self._pending = deque()
+        self._decoder = RecordDecoder()
+        self._epoll = None
+        if hasattr(select, 'epoll'):
+            self._epoll = select.epoll()
+            self._epoll.register(self.socket.fileno(), select.EPOLLIN)
+
+    def close(self):
+        """Closes the listening socket and all connections."""
+        for fd in self._connections.keys():
+            self._drop(fd)
+        if self._epoll is not None:
+            self._epoll.close()
+            self._epoll = None
+        self.socket.close()
+
+    def fileno(self):
+        if self._epoll is not None:
+            return self._epoll.fileno()
+
+    def _drop(self, fd):
+        sock = self._connections.pop(fd)[0]
+        if self._epoll is not None:
+            self._epoll.unregister(fd)
+        sock.close()
+
+    def _accept(self):
+        while 1:
+            try:
+                sock = self.socket.accept()[0]
+            except socket.error, e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            sock.setblocking(0)
+            self._connections[sock.fileno()] = [sock, '']
+            if self._epoll is not None:
+                self._epoll.register(sock.fileno(), select.EPOLLIN)
+
+    def _read(self, fd):
+        connection = self._connections[fd]
+        try:
+            data = connection[0].recv(65536)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            data = ''
+        if not data:
+            self._drop(fd)
+            return
+        try:
+            frames, connection[1] = split_frames(connection[1] + data)
+        except ValueError:
+            self._drop(fd)
+            return
+        for frame in frames:
+            self._pending.extend(self._decoder.decode_many(frame))
+
+    def _poll(self, timeout):
+        listener = self.socket.fileno()
+        if self._epoll is not None:
+            if timeout is None:
+                timeout = -1
+            fds = [fd for fd, event in self._epoll.poll(timeout)]
+        else:
+            fds = _wait_readable([listener] + self._connections.keys(),
+                                 timeout)
+        for fd in fds:
+            if fd == listener:
+                self._accept()
+            elif fd in self._connections:
+                self._read(fd)
+
+    def recv(self, timeout=None):
+        if timeout:
+            deadline = time.time() + timeout
+        while not self._pending:
+            if timeout is None or timeout == 0:
+                self._poll(timeout)
+                if timeout == 0:
+                    break
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._poll(remaining)
+        if self._pending:
+            return self._pending.popleft()
 
 
 class ExecnetChannelHandler(Handler):
@@ -298,12 +1553,20 @@ class ExecnetChannelHandler(Handler):
     to a different process.
     """
 
-    def __init__(self, channel, level=NOTSET, filter=None, bubble=False):
+    def __init__(self, channel, level=NOTSET, filter=None, bubble=False,
+                 codec=None):
         Handler.__init__(self, level, filter, bubble)
         self.channel = channel
+        self.codec = codec
+        self.lock = Lock()
 
     def emit(self, record):
-        self.channel.send(record.to_dict(json_safe=True))
+        record = stamp_record(record)
+        if self.codec is not None:
+            with self.lock:
+                self.channel.send(self.codec.encode(record))
+        else:
+            self.channel.send(record.to_dict(json_safe=True))
 
 
 class ExecnetChannelSubscriber(SubscriberBase):
@@ -311,56 +1574,225 @@ class ExecnetChannelSubscriber(SubscriberBase):
 
     def __init__(self, channel):
         self.channel = channel
+        self._decoder = RecordDecoder()
 
-    def recv(self, timeout=-1):
-        try:
-            rv = self.channel.receive(timeout=timeout)
-        except self.channel.RemoteError:
-            #XXX: handle
-            return None
-        except (self.channel.TimeoutError, EOFError):
-            return None
+    def recv(self, timeout=None):
+        if timeout:
+            deadline = time.time() + timeout
+        while 1:
+            try:
+                rv = self.channel.receive(timeout=timeout)
+            except self.channel.RemoteError:
+                #XXX: handle
+                return None
+            except (self.channel.TimeoutError, EOFError):
+                return None
+            if not isinstance(rv, str):
+                return LogRecord.from_dict(rv)
+            rv = self._decoder.decode(rv)
+            if rv is not None:
+                return rv
+            if timeout:
+                timeout = max(deadline - time.time(), 0)
+
+
+class RecordQueue(object):
+    """The queue the :class:`ThreadedWrapperHandler` uses to pass records to
+    its worker threads.  It can be limited to `max_size` records and to
+    `max_bytes` bytes (as estimated by the handler) and decides what
+    happens if a record does not fit anymore (`overflow`):
+
+    ``'block'``
+        the logging thread waits until there is room again, for at most
+        `timeout` seconds (or forever if the timeout is `None`).  If it
+        times out, the new record is dropped.
+    ``'drop_newest'``
+        the new record is dropped.
+    ``'drop_oldest'``
+        the oldest queued records are dropped to make room.
+    ``'drop_lowest'``
+        the queued records with the lowest level are dropped first, the
+        oldest of them first.  If the new record has a lower level than all
+        queued records, the new record is dropped instead.
+
+    If `prioritize` is `True` the records with the highest level are
+    handed out first, otherwise records come out in the order they were
+    put in.
+    """
+
+    overflow_policies = frozenset(['block', 'drop_newest', 'drop_oldest',
+                                   'drop_lowest'])
+
+    def __init__(self, max_size=0, max_bytes=0, overflow='block',
+                 timeout=None, prioritize=False):
+        if overflow not in self.overflow_policies:
+            raise ValueError('unknown overflow policy %r' % overflow)
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.overflow = overflow
+        self.timeout = timeout
+        self.prioritize = prioritize
+        #: the number of records that were dropped because the queue was
+        #: full.
+        self.dropped = 0
+        #: the number of bytes of all records in the queue.
+        self.bytes = 0
+        self.closed = False
+        self._mutex = Lock()
+        self._not_empty = Condition(self._mutex)
+        self._not_full = Condition(self._mutex)
+        self._next_seq = count().next
+        # the entries are ``(-level or 0, seq, size, record)`` tuples, in a
+        # heap if prioritized, otherwise in a deque.
+        if prioritize:
+            self._entries = []
+        else:
+            self._entries = deque()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _is_full(self, size):
+        n = len(self._entries)
+        if self.max_size and n >= self.max_size:
+            return True
+        return bool(self.max_bytes and n and
+                    self.bytes + size > self.max_bytes)
+
+    def _remove(self, entry):
+        if self.prioritize:
+            self._entries.remove(entry)
+            heapq.heapify(self._entries)
         else:
-            return LogRecord.from_dict(rv)
+            self._entries.remove(entry)
+        self.bytes -= entry[2]
+        self.dropped += 1
+
+    def _make_room(self, record, size):
+        """Applies the overflow policy until the record fits.  Returns
+        `False` if the new record has to be dropped.
+        """
+        deadline = None
+        while self._is_full(size):
+            if self.overflow == 'drop_newest':
+                return False
+            elif self.overflow == 'drop_oldest':
+                if self.prioritize:
+                    oldest = min(self._entries, key=lambda x: x[1])
+                else:
+                    oldest = self._entries[0]
+                self._remove(oldest)
+            elif self.overflow == 'drop_lowest':
+                lowest = min(self._entries,
+                             key=lambda x: (x[3].level, x[1]))
+                if record.level < lowest[3].level:
+                    return False
+                self._remove(lowest)
+            else:
+                if self.timeout is None:
+                    self._not_full.wait()
+                    continue
+                if deadline is None:
+                    deadline = time.time() + self.timeout
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._not_full.wait(remaining)
+        return True
+
+    def put(self, record, size=0):
+        """Puts a record into the queue.  Returns `False` if the record
+        was dropped.
+        """
+        with self._mutex:
+            if self.closed or not self._make_room(record, size):
+                self.dropped += 1
+                return False
+            if self.prioritize:
+                heapq.heappush(self._entries, (-record.level,
+                                               self._next_seq(),
+                                               size, record))
+            else:
+                self._entries.append((0, self._next_seq(), size, record))
+            self.bytes += size
+            self._not_empty.notify()
+            return True
+
+    def get(self):
+        """Returns the next record.  Blocks until there is one or returns
+        `None` once the queue is closed and empty.
+        """
+        with self._mutex:
+            while not self._entries:
+                if self.closed:
+                    return None
+                self._not_empty.wait()
+            if self.prioritize:
+                entry = heapq.heappop(self._entries)
+            else:
+                entry = self._entries.popleft()
+            self.bytes -= entry[2]
+            self._not_full.notify()
+            return entry[3]
+
+    def close(self):
+        """Closes the queue.  Records that are already queued can still
+        be fetched, new records are dropped.
+        """
+        with self._mutex:
+            self.closed = True
+            self._not_empty.notifyAll()
+            self._not_full.notifyAll()
 
 
 class TWHThreadController(object):
     """A very basic thread controller that pulls things in from a
     queue and sends it to a handler.  Both queue and handler are
-    taken from the passed :class:`ThreadedWrapperHandler`.
+    taken from the passed :class:`ThreadedWrapperHandler`.  It starts
+    as many threads as the wrapper handler has `workers`.
     """
-    _sentinel = object()
 
     def __init__(self, wrapper_handler):
         self.wrapper_handler = wrapper_handler
         self.running = False
-        self._thread = None
+        self._threads = []
 
     def start(self):
-        """Starts the task thread."""
+        """Starts the task threads."""
         self.running = True
-        self._thread = Thread(target=self._target)
-        self._thread.setDaemon(True)
-        self._thread.start()
+        for x in xrange(self.wrapper_handler.workers):
+            thread = Thread(target=self._target)
+            thread.setDaemon(True)
+            thread.start()
+            self._threads.append(thread)
 
     def stop(self):
-        """Stops the task thread."""
+        """Stops the task threads after the queued records are handled."""
         if self.running:
-            self.wrapper_handler.queue.put_nowait(self._sentinel)
-            self._thread.join()
-            self._thread = None
+            self.wrapper_handler.queue.close()
+            for thread in self._threads:
+                thread.join()
+            self._threads = []
+            self.running = False
 
     def _target(self):
+        queue = self.wrapper_handler.queue
+        handler = self.wrapper_handler.handler
         while 1:
-            record = self.wrapper_handler.queue.get()
-            if record is self._sentinel:
-                self.running = False
+            record = queue.get()
+            if record is None:
                 break
-            self.wrapper_handler.handler.emit(record)
+            handler.emit(record)
+
+
+def _wrapped_property(name):
+    def _get(self):
+        return getattr(self.handler, name)
+    return property(_get)
 
 
 class ThreadedWrapperHandler(Handler):
-    """This handled uses a single background thread to dispatch log records
+    """This handled uses a background thread to dispatch log records
     to a specific other handler using an internal queue.  The idea is that if
     you are using a handler that requires some time to hand off the log records
     (such as the mail handler) and would block your request, you can let
@@ -374,12 +1806,34 @@ class ThreadedWrapperHandler(Handler):
     >>> twh.level_name = 'WARNING'
     >>> twh.handler.level_name
     'WARNING'
+
+    By default the queue is unbounded.  To limit the memory a slow handler
+    can pile up, pass `max_size` (number of records) and/or `max_bytes`
+    (the size of the messages and tracebacks) and pick what happens with
+    records that do not fit (`overflow`, see :class:`RecordQueue` for the
+    policies and `timeout`).  The number of dropped records is available
+    as :attr:`dropped_records`.  If `prioritize` is `True`, records with a
+    higher level are handled first when records pile up.
+
+    With `workers` greater than one, several threads hand records to the
+    wrapped handler at the same time.  Only use this if the wrapped
+    handler can deal with that.
     """
-    _direct_attrs = frozenset(['handler', 'queue', 'controller'])
+    _direct_attrs = frozenset(['handler', 'queue', 'controller', 'workers'])
 
-    def __init__(self, handler):
+    # the attributes the dispatching code looks at for every record are
+    # properties, for everything else there is :meth:`__getattr__`.
+    level = _wrapped_property('level')
+    filter = _wrapped_property('filter')
+    bubble = _wrapped_property('bubble')
+    blackhole = _wrapped_property('blackhole')
+
+    def __init__(self, handler, max_size=0, max_bytes=0, overflow='block',
+                 timeout=None, prioritize=False, workers=1):
         self.handler = handler
-        self.queue = ThreadQueue(-1)
+        self.queue = RecordQueue(max_size, max_bytes, overflow, timeout,
+                                 prioritize)
+        self.workers = workers
         self.controller = TWHThreadController(self)
         self.controller.start()
 
@@ -391,33 +1845,468 @@ class ThreadedWrapperHandler(Handler):
             return Handler.__setattr__(self, name, value)
         setattr(self.handler, name, value)
 
+    @property
+    def dropped_records(self):
+        """The number of records that were dropped because the queue was
+        full.
+        """
+        return self.queue.dropped
+
     def close(self):
         self.controller.stop()
         self.handler.close()
 
     def emit(self, record):
-        self.queue.put_nowait(record)
+        # the record is closed once the logging call returns, so the
+        # worker threads get a snapshot.
+        record = FrozenRecord.from_record(record)
+        size = 0
+        if self.queue.max_bytes:
+            size = len(record.msg) + len(record.formatted_exception or '')
+        self.queue.put(record, size)
+
+
+class SpoolingHandler(Handler):
+    """Hands records to another handler (usually a transport like the
+    :class:`SocketHandler`) and spools them to disk while that handler
+    does not take them.  Once it takes records again, the spooled records
+    are replayed in order from a background thread, and records logged in
+    the meantime are appended to the spool so that nothing overtakes them::
+
+        handler = SpoolingHandler(SocketHandler(('logs.local', 5170),
+                                                overflow='raise'),
+                                  '/var/spool/app-logs')
+
+    The wrapped handler signals that it cannot take a record by raising an
+    exception from :meth:`~logbook.Handler.emit`.  The socket handler does
+    this with ``overflow='raise'`` once its own buffer is full because the
+    collector is down or too slow.  Handlers that do not raise (like the
+    :class:`ZeroMQHandler`, which drops records itself) cannot be spooled.
+
+    The spool is a directory of append-only segment files of about
+    `segment_size` bytes with the records in the binary format
+    (:class:`BinaryCodec`) and a checkpoint file with the position of the
+    next record to replay, which is updated every `checkpoint_interval`
+    records and after every segment.  If the application restarts with a
+    spool left, the replay continues at the checkpoint (records after it
+    might be sent twice).  The spool uses at most `max_size` bytes;
+    records that do not fit are dropped and counted in :attr:`dropped`.
+    A failed replay is retried after `retry_interval` seconds.
+    """
+
+    _segment_re = re.compile(r'^spool-(\d{8})\.log$')
+
+    def __init__(self, handler, directory, max_size=256 * 1024 * 1024,
+                 segment_size=16 * 1024 * 1024, checkpoint_interval=1000,
+                 retry_interval=1, level=NOTSET, filter=None, bubble=False):
+        Handler.__init__(self, level, filter, bubble)
+        self.handler = handler
+        self.directory = directory
+        self.max_size = max_size
+        self.segment_size = segment_size
+        self.checkpoint_interval = checkpoint_interval
+        self.retry_interval = retry_interval
+        self.codec = BinaryCodec()
+        #: the number of records that were dropped because the spool was
+        #: full.
+        self.dropped = 0
+        self.lock = Lock()
+        self._closed = Condition(self.lock)
+        self._closing = False
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # the numbers of the segments on disk, the last one is written to
+        self._segments = sorted(int(match.group(1)) for match in
+                                map(self._segment_re.match,
+                                    os.listdir(directory)) if match)
+        self._size = sum(os.path.getsize(self._segment_path(segment))
+                         for segment in self._segments)
+        self._file = None
+        self._replayer = None
+        if self._segments:
+            self._start_replay()
+
+    @property
+    def spooling(self):
+        """`True` while records go to the spool."""
+        return bool(self._segments)
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, 'spool-%08d.log' % segment)
+
+    def _read_checkpoint(self):
+        try:
+            f = open(os.path.join(self.directory, 'checkpoint'))
+            try:
+                segment, offset = map(int, f.read().split())
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            return self._segments[0], 0
+        if segment not in self._segments:
+            return self._segments[0], 0
+        return segment, offset
+
+    def _write_checkpoint(self, segment, offset):
+        filename = os.path.join(self.directory, 'checkpoint')
+        f = open(filename + '.tmp', 'w')
+        try:
+            f.write('%d %d\n' % (segment, offset))
+        finally:
+            f.close()
+        os.rename(filename + '.tmp', filename)
+
+    def _spool(self, record):
+        data = self.codec.encode(record)
+        frame = _frame_length.pack(len(data)) + data
+        if self._size + len(frame) > self.max_size:
+            self.dropped += 1
+            return
+        if self._file is None or self._file.tell() >= self.segment_size:
+            if self._file is not None:
+                self._file.close()
+            if self._segments:
+                self._segments.append(self._segments[-1] + 1)
+            else:
+                self._segments.append(0)
+            self._file = open(self._segment_path(self._segments[-1]), 'ab')
+        self._file.write(frame)
+        self._file.flush()
+        self._size += len(frame)
+
+    def _start_replay(self):
+        if self._replayer is None:
+            self._replayer = Thread(target=self._replay_forever)
+            self._replayer.setDaemon(True)
+            self._replayer.start()
+
+    def _replay_segment(self, segment, offset):
+        """Replays a segment from the offset until it ends (and is not
+        written to anymore) or the handler fails.  Returns the offset of
+        the next record and `True` if the segment was replayed completely.
+        """
+        f = open(self._segment_path(segment), 'rb')
+        try:
+            f.seek(offset)
+            rest = ''
+            replayed = 0
+            while not self._closing:
+                chunk = f.read(256 * 1024)
+                if not chunk:
+                    with self.lock:
+                        if self._segments[-1] != segment:
+                            return offset, True
+                        chunk = f.read(256 * 1024)
+                        if not chunk:
+                            # everything was replayed, new records go to
+                            # the handler again
+                            if self._file is not None:
+                                self._file.close()
+                                self._file = None
+                            return offset, True
+                frames, rest = split_frames(rest + chunk)
+                for frame in frames:
+                    try:
+                        self.handler.emit(decode_record(frame))
+                    except Exception:
+                        return offset, False
+                    offset += _frame_length.size + len(frame)
+                    replayed += 1
+                    if replayed % self.checkpoint_interval == 0:
+                        self._write_checkpoint(segment, offset)
+            return offset, False
+        finally:
+            f.close()
+
+    def _replay_forever(self):
+        while 1:
+            with self.lock:
+                if self._closing or not self._segments:
+                    self._replayer = None
+                    return
+                segment, offset = self._read_checkpoint()
+            offset, done = self._replay_segment(segment, offset)
+            with self.lock:
+                if not done:
+                    self._write_checkpoint(segment, offset)
+                    if not self._closing:
+                        self._closed.wait(self.retry_interval)
+                    continue
+                self._size -= os.path.getsize(self._segment_path(segment))
+                os.remove(self._segment_path(segment))
+                self._segments.remove(segment)
+                if self._segments:
+                    self._write_checkpoint(self._segments[0], 0)
+                else:
+                    os.remove(os.path.join(self.directory, 'checkpoint'))
+
+    def close(self):
+        with self.lock:
+            self._closing = True
+            self._closed.notify()
+            replayer = self._replayer
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        if replayer is not None:
+            replayer.join()
+        self.handler.close()
+
+    def emit(self, record):
+        with self.lock:
+            if self._segments:
+                self._spool(record)
+                return
+        # the wrapped handler is called without the lock, it might block
+        # and the replay thread needs the lock to make progress.
+        try:
+            self.handler.emit(record)
+            return
+        except Exception:
+            pass
+        with self.lock:
+            # another thread might have started spooling in the meantime
+            if not self._segments:
+                self._write_checkpoint(0, 0)
+                self._start_replay()
+            self._spool(record)
+
+
+class HandlerPool(object):
+    """A pool of daemon threads that run tasks for the
+    :class:`FanoutHandler`.  All fan-out handlers share one pool of
+    `workers` threads unless they are given their own.  The threads are
+    started with the first task.  A forked process starts threads of its
+    own with an empty queue, the tasks of the parent are not run twice.
+    """
+
+    def __init__(self, workers=8):
+        self.workers = workers
+        # the task queue by process id
+        self._queues = {}
+
+    def _get_queue(self):
+        pid = os.getpid()
+        queue = self._queues.get(pid)
+        if queue is None:
+            queue = ThreadQueue()
+            # setdefault is atomic, so exactly one thread starts the
+            # threads of this process
+            if self._queues.setdefault(pid, queue) is not queue:
+                return self._queues[pid]
+            for other in self._queues.keys():
+                if other != pid:
+                    self._queues.pop(other, None)
+            for x in xrange(self.workers):
+                thread = Thread(target=self._target, args=(queue,))
+                thread.setDaemon(True)
+                thread.start()
+        return queue
+
+    def submit(self, func, *args):
+        """Runs ``func(*args)`` in one of the threads."""
+        self._get_queue().put((func, args))
+
+    def _target(self, queue):
+        while 1:
+            func, args = queue.get()
+            try:
+                func(*args)
+            except Exception:
+                try:
+                    traceback.print_exc(None, sys.stderr)
+                except IOError:
+                    pass
+
+
+_default_pool = HandlerPool()
+
+
+class _FanoutCall(object):
+    """Counts down the handlers of one record that are still running."""
+
+    def __init__(self, count):
+        self.count = count
+        self.lock = Lock()
+        self.done = Event()
+
+    def handle(self, handler, record):
+        try:
+            handler.handle(record)
+        finally:
+            self.finish()
+
+    def finish(self):
+        with self.lock:
+            self.count -= 1
+            if not self.count:
+                self.done.set()
+
+
+class _FanoutLane(object):
+    """The records that wait for one child handler.  They are handled one
+    after another by a single task on the pool.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.items = deque()
+        self.scheduled = False
+
+
+class FanoutHandler(Handler):
+    """Passes each record to several handlers at the same time, so that a
+    record that goes to slow handlers (mails, tickets, remote syslog) only
+    takes as long as the slowest of them instead of all of them together::
+
+        handler = FanoutHandler([MailHandler(...), TicketingHandler(...),
+                                 SyslogHandler()], level='ERROR')
+
+    The record is frozen (see :class:`~logbook.FrozenRecord`) once and
+    handed to the child handlers on a :class:`HandlerPool` which is shared
+    by all fan-out handlers unless a `pool` is given.  By default the
+    logging call does not wait for the child handlers.  If `wait` is
+    `True`, it waits until they are done, but at most `timeout` seconds if
+    that is given.
+
+    Each child gets its records one after another in the order they were
+    logged, it never runs in more than one thread at a time.  Up to
+    `max_pending` records wait for each child, records that do not fit
+    because the child cannot keep up are dropped for that child and
+    counted in :attr:`dropped`.
+
+    The child handlers are treated like a stack of handlers in the given
+    order: a child only gets the records of its level that pass its
+    filter, a black hole child stops the record from reaching the children
+    after it and so does a child that does not bubble.  Because the
+    children run at the same time, a child is assumed to have handled
+    every record it gets (the return value of its
+    :meth:`~logbook.Handler.handle` is not waited for).
+    """
+
+    def __init__(self, handlers, wait=False, timeout=None, pool=None,
+                 max_pending=1000, level=NOTSET, filter=None, bubble=False):
+        Handler.__init__(self, level, filter, bubble)
+        self.handlers = list(handlers)
+        self.wait = wait
+        self.timeout = timeout
+        self.pool = pool or _default_pool
+        self.max_pending = max_pending
+        #: the number of records that were dropped for a child because
+        #: too many records were waiting for it.
+        self.dropped = 0
+        # the lock and the lanes of the children by process id, a forked
+        # process does not share them with its parent.
+        self._lanes = {}
+
+    def close(self):
+        for handler in self.handlers:
+            handler.close()
+
+    def select_handlers(self, record):
+        """Returns the child handlers that get the record."""
+        rv = []
+        for handler in self.handlers:
+            if record.level < handler.level:
+                continue
+            if handler.blackhole:
+                break
+            if handler.filter is not None \
+               and not handler.filter(record, handler):
+                continue
+            rv.append(handler)
+            if not handler.bubble:
+                break
+        return rv
+
+    def _get_lanes(self):
+        pid = os.getpid()
+        rv = self._lanes.get(pid)
+        if rv is None:
+            rv = self._lanes.setdefault(pid, (Lock(), {}))
+        return rv
+
+    def _run_lane(self, lock, lane):
+        while 1:
+            with lock:
+                if not lane.items:
+                    lane.scheduled = False
+                    return
+                record, call = lane.items.popleft()
+            call.handle(lane.handler, record)
+
+    def emit(self, record):
+        handlers = self.select_handlers(record)
+        if not handlers:
+            return
+        record = FrozenRecord.from_record(record)
+        call = _FanoutCall(len(handlers))
+        lock, lanes = self._get_lanes()
+        with lock:
+            for handler in handlers:
+                lane = lanes.get(handler)
+                if lane is None:
+                    lane = lanes[handler] = _FanoutLane(handler)
+                if len(lane.items) >= self.max_pending:
+                    self.dropped += 1
+                    call.finish()
+                    continue
+                lane.items.append((record, call))
+                if not lane.scheduled:
+                    lane.scheduled = True
+                    self.pool.submit(self._run_lane, lock, lane)
+        if self.wait:
+            call.done.wait(self.timeout)
 
 
 class GroupMember(ThreadController):
-    def __init__(self, subscriber, queue):
+    """Receives the records of a subscriber without a file descriptor in
+    a thread for a :class:`SubscriberGroup`.  The records are put into
+    `queue` and every record is announced with a byte written to the
+    `wakeup` file descriptor.
+    """
+
+    def __init__(self, subscriber, queue, wakeup=None):
         ThreadController.__init__(self, subscriber, None)
         self.queue = queue
+        self.wakeup = wakeup
 
-    def _target(self):
-        if self.setup is not None:
-            self.setup.push_thread()
+    def handle_once(self, timeout):
+        record = self.subscriber.recv(timeout)
+        if record is None:
+            return False
         try:
-            while self.running:
-                record = self.subscriber.recv()
-                if record:
-                    try:
-                        self.queue.put(record, timeout=0.05)
-                    except Queue.Full:
-                        pass
-        finally:
-            if self.setup is not None:
-                self.setup.pop_thread()
+            self.queue.put(record, timeout=0.05)
+        except Full:
+            return True
+        if self.wakeup is not None:
+            try:
+                os.write(self.wakeup, 'x')
+            except OSError, e:
+                if e.errno != errno.EAGAIN:
+                    raise
+        return True
+
+
+def _set_nonblocking(fd):
+    import fcntl
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+
+def _wait_readable(fds, timeout):
+    """Waits until one of the file descriptors is readable and returns
+    the readable ones.  This uses :func:`select.poll` where available
+    because :func:`select.select` cannot handle large descriptors.
+    """
+    if not hasattr(select, 'poll'):
+        return select.select(fds, [], [], timeout)[0]
+    poll = select.poll()
+    for fd in fds:
+        poll.register(fd, select.POLLIN)
+    if timeout is not None:
+        timeout = int(timeout * 1000)
+    return [fd for fd, event in poll.poll(timeout)]
 
 
 class SubscriberGroup(SubscriberBase):
@@ -434,28 +2323,162 @@ class SubscriberGroup(SubscriberBase):
         ])
         with target_handler:
             subscribers.dispatch_forever()
+
+    The group receives from all subscribers that have a file descriptor
+    (see :meth:`SubscriberBase.fileno`) in the calling thread by waiting
+    for any of them to become readable, so a group of hundreds of
+    subscribers does not need hundreds of threads.  Only subscribers
+    without a file descriptor get a thread of their own.
+
+    Up to `queue_limit` received records are buffered in the group.  If
+    the buffer is full the group stops receiving from its subscribers
+    until records were taken out.
+
+    By default records are returned in the order they arrive.  If
+    `ordered` is `True`, the group merges the records of all subscribers
+    by time instead: each record is held back until it is older than
+    `reorder_window` seconds, so records of different processes that
+    arrive out of order within that window come out in order.  Records
+    with the same time are ordered by their source and sequence number
+    (see :func:`stamp_record`).  If more than `queue_limit` records are
+    held back, the oldest are returned early.
     """
-    def __init__(self, subscribers=None, queue_limit=10):
+
+    #: the number of records that are received from one subscriber
+    #: before the next one gets its turn.
+    max_records_per_subscriber = 100
+
+    def __init__(self, subscribers=None, queue_limit=10000, ordered=False,
+                 reorder_window=1.0):
         self.members = []
+        self.queue_limit = queue_limit
         self.queue = ThreadQueue(queue_limit)
+        self.ordered = ordered
+        self.reorder_window = timedelta(seconds=reorder_window)
+        self._buffer = deque()
+        # the records that are held back in ordered mode
+        self._heap = []
+        self._heap_counter = count().next
+        self._subscribers = {}
+        # subscribers that might have records without their descriptor
+        # being readable (ZeroMQ only signals new records).
+        self._maybe_readable = set()
+        self._wakeup = os.pipe()
+        for fd in self._wakeup:
+            _set_nonblocking(fd)
         for subscriber in subscribers or []:
             self.add(subscriber)
 
     def add(self, subscriber):
         """Adds the given `subscriber` to the group."""
-        member = GroupMember(subscriber, self.queue)
-        member.start()
-        self.members.append(member)
+        fd = subscriber.fileno()
+        if fd is None:
+            member = GroupMember(subscriber, self.queue, self._wakeup[1])
+            member.start()
+            self.members.append(member)
+        else:
+            self._subscribers[fd] = subscriber
+            self._maybe_readable.add(fd)
 
-    def recv(self, timeout=None):
+    def _add(self, records):
+        if not self.ordered:
+            self._buffer.extend(records)
+            return
+        for record in records:
+            extra = record.extra
+            heapq.heappush(self._heap, (record.time or _epoch,
+                                        extra.get('_logbook_source') or u'',
+                                        extra.get('_logbook_seq') or 0,
+                                        self._heap_counter(), record))
+
+    def _release(self):
+        """Moves the held back records that are old enough into the
+        buffer.  Returns the number of seconds until the next one is.
+        """
+        heap = self._heap
+        limit = datetime.utcnow() - self.reorder_window
+        while heap and (heap[0][0] <= limit or
+                        len(heap) >= self.queue_limit):
+            self._buffer.append(heapq.heappop(heap)[-1])
+        if heap:
+            delta = heap[0][0] - limit
+            return delta.days * 86400 + delta.seconds + \
+                   delta.microseconds / 1e6
+
+    def _fill(self):
+        """Moves the records that are available into the buffer."""
+        room = self.queue_limit - len(self._buffer) - len(self._heap)
+        records = []
         try:
-            return self.queue.get(timeout=timeout)
+            while len(records) < room:
+                records.append(self.queue.get_nowait())
         except Empty:
-            return
+            pass
+        self._add(records)
+        room -= len(records)
+        for fd in list(self._maybe_readable):
+            if room <= 0:
+                break
+            max_records = min(room, self.max_records_per_subscriber)
+            records = self._subscribers[fd].recv_many(max_records, 0)
+            self._add(records)
+            room -= len(records)
+            # subscribers skip what they cannot decode, fewer records
+            # mean that nothing is left
+            if len(records) < max_records:
+                self._maybe_readable.discard(fd)
+
+    def _wait(self, timeout):
+        """Waits for records and marks the readable subscribers."""
+        wakeup = self._wakeup[0]
+        for fd in _wait_readable(self._subscribers.keys() + [wakeup],
+                                 timeout):
+            if fd == wakeup:
+                try:
+                    while os.read(wakeup, 512):
+                        pass
+                except OSError, e:
+                    if e.errno != errno.EAGAIN:
+                        raise
+            else:
+                self._maybe_readable.add(fd)
+
+    def recv_many(self, max_records=100, timeout=None):
+        if timeout:
+            deadline = time.time() + timeout
+        while 1:
+            self._fill()
+            pending = None
+            if self.ordered:
+                pending = self._release()
+            if self._buffer or timeout == 0 or self._wakeup is None:
+                break
+            wait = None
+            if timeout is not None:
+                wait = deadline - time.time()
+                if wait <= 0:
+                    break
+            if pending is not None and (wait is None or pending < wait):
+                wait = pending
+            self._wait(wait)
+        buffer = self._buffer
+        return [buffer.popleft()
+                for x in xrange(min(max_records, len(buffer)))]
+
+    def recv(self, timeout=None):
+        records = self.recv_many(1, timeout)
+        if records:
+            return records[0]
 
     def stop(self):
         """Stops the group from internally recieving any more messages, once the
         internal queue is exhausted :meth:`recv` will always return `None`.
         """
         for member in self.members:
-            self.member.stop()
+            member.stop()
+        self._subscribers.clear()
+        self._maybe_readable.clear()
+        if self._wakeup is not None:
+            for fd in self._wakeup:
+                os.close(fd)
+            self._wakeup = None
@@ -7,9 +7,11 @@ import os
 import re
 import new
 import sys
+import gzip
 import time
 import thread
 import pickle
+import threading
 import shutil
 import unittest
 import tempfile
@@ -190,6 +192,34 @@ class BasicAPITestCase(LogbookTestCase):
                     continue
                 self.assertEqual(value, getattr(imported, key))
 
+    def test_frozen_record(self):
+        frozen = []
+        class FreezingHandler(logbook.Handler):
+            def emit(self, record):
+                frozen.append(logbook.FrozenRecord.from_record(record))
+        with FreezingHandler():
+            try:
+                1/0
+            except Exception:
+                self.log.exception('Failed in {0}', 'test', extra={'a': 1})
+        record = frozen[0]
+        self.assertEqual(record.message, 'Failed in test')
+        self.assertEqual(record.args, ())
+        self.assertEqual(record.func_name, 'test_frozen_record')
+        self.assertEqual(record.thread_name,
+                         threading.currentThread().getName())
+        self.assertEqual(record.exception_shortname, 'ZeroDivisionError')
+        self.assertEqual(record.extra['a'], 1)
+        self.assertEqual(record.extra['missing'], u'')
+        self.assertRaises(AttributeError, setattr, record, 'level', 0)
+        record.close()
+        self.assert_(logbook.FrozenRecord.from_record(record) is record)
+
+        for p in xrange(pickle.HIGHEST_PROTOCOL + 1):
+            imported = pickle.loads(pickle.dumps(record, p))
+            self.assert_(type(imported) is logbook.FrozenRecord)
+            self.assertEqual(imported.__dict__, record.__dict__)
+
 
 class HandlerTestCase(LogbookTestCase):
 
@@ -225,6 +255,90 @@ class HandlerTestCase(LogbookTestCase):
             self.assertEqual(f.readline(),
                              'WARNING:testlogger:warning message\n')
 
+    def test_file_handler_durable(self):
+        from logbook import handlers
+        syncs = []
+        fdatasync = handlers._fdatasync
+        def slow_fdatasync(fd):
+            syncs.append(fd)
+            time.sleep(0.005)
+            fdatasync(fd)
+        handler = logbook.FileHandler(self.filename, durable=True,
+                                      format_string='{record.message}')
+        def log():
+            for x in xrange(20):
+                self.log.warn('durable')
+        handlers._fdatasync = slow_fdatasync
+        try:
+            with handler.applicationbound():
+                log()
+                self.assertEqual(len(syncs), 20)
+                threads = [threading.Thread(target=log)
+                           for x in xrange(8)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+        finally:
+            handlers._fdatasync = fdatasync
+            handler.close()
+        # the threads that logged at the same time shared syncs
+        self.assert_(len(syncs) < 20 + 160)
+        with open(self.filename) as f:
+            self.assertEqual(f.read(), 'durable\n' * 180)
+
+    def test_file_handler_durable_sync_error(self):
+        from logbook import handlers
+        syncs = []
+        errors = []
+        fdatasync = handlers._fdatasync
+        def failing_fdatasync(fd):
+            syncs.append(fd)
+            if len(syncs) == 1:
+                raise OSError(5, 'Input/output error')
+            fdatasync(fd)
+        class FileHandler(logbook.FileHandler):
+            def handle_error(self, record, exc_info):
+                errors.append(exc_info[1])
+        handler = FileHandler(self.filename, durable=True, commit_interval=5,
+                              commit_batch_size=3)
+        handlers._fdatasync = failing_fdatasync
+        try:
+            with handler.applicationbound():
+                # the three records share the failing sync
+                threads = [threading.Thread(target=self.log.warn,
+                                            args=('durable',))
+                           for x in xrange(3)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                self.assertEqual(len(syncs), 1)
+                self.assertEqual(len(errors), 3)
+                self.assertEqual(errors[0].errno, 5)
+                handler.commit_batch_size = 1
+                self.log.warn('durable')
+                self.assertEqual(len(syncs), 2)
+                self.assertEqual(len(errors), 3)
+                self.assertEqual(handler._failed_syncs, [])
+        finally:
+            handlers._fdatasync = fdatasync
+            handler.close()
+
+        # batches do not bypass the emit of subclasses
+        emitted = []
+        class RecordingFileHandler(logbook.FileHandler):
+            def emit(self, record):
+                emitted.append(record.message)
+                logbook.FileHandler.emit(self, record)
+        handler = RecordingFileHandler(self.filename, durable=True)
+        with handler.applicationbound():
+            logbook.dispatch_records([logbook.LogRecord('App', logbook.WARNING,
+                                                        'Record %d' % x)
+                                      for x in xrange(2)])
+        handler.close()
+        self.assertEqual(emitted, ['Record 0', 'Record 1'])
+
     def test_monitoring_file_handler(self):
         if os.name == 'nt':
             # skipped on windows
@@ -242,6 +356,21 @@ class HandlerTestCase(LogbookTestCase):
             self.assertEqual(f.read().strip(),
                              'WARNING:testlogger:another warning message')
 
+    def test_monitoring_file_handler_check_interval(self):
+        handler = logbook.MonitoringFileHandler(self.filename,
+            format_string='{record.message}', check_interval=60)
+        with handler.threadbound():
+            self.log.warn('first')
+            os.rename(self.filename, self.filename + '.old')
+            self.log.warn('second')
+            handler._next_check = 0
+            self.log.warn('third')
+        handler.close()
+        with open(self.filename + '.old') as f:
+            self.assertEqual(f.read(), 'first\nsecond\n')
+        with open(self.filename) as f:
+            self.assertEqual(f.read(), 'third\n')
+
     def test_custom_formatter(self):
         def custom_format(record, handler):
             return record.level_name + ':' + record.message
@@ -252,6 +381,27 @@ class HandlerTestCase(LogbookTestCase):
             self.assertEqual(f.readline(),
                              'WARNING:Custom formatters are awesome\n')
 
+    def test_formatting_outside_of_lock(self):
+        locked = []
+        def custom_format(record, handler):
+            locked.append(handler.lock.locked())
+            return record.message
+        stream = StringIO()
+        handlers = [
+            logbook.StreamHandler(stream),
+            logbook.FileHandler(self.filename),
+            logbook.RotatingFileHandler(self.filename + '.rot'),
+        ]
+        for handler in handlers:
+            handler.formatter = custom_format
+            with handler:
+                self.log.warn(u'Umlauts äöü')
+        self.assertEqual(locked, [False, False, False])
+        self.assertEqual(stream.getvalue(),
+                         'Umlauts \xc3\xa4\xc3\xb6\xc3\xbc\n')
+        with open(self.filename) as f:
+            self.assertEqual(f.read(), 'Umlauts \xc3\xa4\xc3\xb6\xc3\xbc\n')
+
     def test_rotating_file_handler(self):
         basename = os.path.join(self.dirname, 'rot.log')
         handler = logbook.RotatingFileHandler(basename, max_size=2048,
@@ -273,6 +423,162 @@ class HandlerTestCase(LogbookTestCase):
             self.assertEqual(f.readline().rstrip(), 'E' * 256)
             self.assertEqual(f.readline().rstrip(), 'F' * 256)
 
+    def test_rotating_file_handler_background_rollover(self):
+        basename = os.path.join(self.dirname, 'rot.log')
+        handler = logbook.RotatingFileHandler(basename, max_size=2048,
+                                              backup_count=3,
+                                              background_rollover=True)
+        handler.format_string = '{record.message}'
+        with handler:
+            for c, x in izip(string.letters, xrange(32)):
+                self.log.warn(c * 256)
+        files = [x for x in os.listdir(self.dirname)
+                 if x.startswith('rot.log')]
+        files.sort()
+
+        self.assertEqual(files, ['rot.log', 'rot.log.1', 'rot.log.2',
+                                 'rot.log.3'])
+        for filename, first in [('rot.log', 'C'), ('rot.log.1', 'v'),
+                                ('rot.log.2', 'o'), ('rot.log.3', 'h')]:
+            with open(os.path.join(self.dirname, filename)) as f:
+                self.assertEqual(f.readline().rstrip(), first * 256)
+
+    def test_rotating_file_handler_background_leftovers(self):
+        import subprocess
+        basename = os.path.join(self.dirname, 'rot.log')
+        process = subprocess.Popen([sys.executable, '-c', 'pass'])
+        process.wait()
+        leftovers = ['rot.log.rollover-%d-1' % process.pid,
+                     'rot.log.next-%d-2' % process.pid,
+                     'rot.log.rollover-%d-1' % os.getpid()]
+        for filename in leftovers:
+            open(os.path.join(self.dirname, filename), 'w').close()
+        handler = logbook.RotatingFileHandler(basename, max_size=2048,
+                                              backup_count=3,
+                                              background_rollover=True)
+        # a second prepare must not replace the staged next file
+        handler._maintenance.submit(handler._prepare_next_file)
+        handler._maintenance.join()
+        next_stream = handler._next_stream
+        self.assertEqual(os.fstat(next_stream.fileno()).st_ino,
+                         os.stat(basename + '.next').st_ino)
+        handler.close()
+        files = sorted(x for x in os.listdir(self.dirname)
+                       if x.startswith('rot.log'))
+        self.assertEqual(files, ['rot.log', leftovers[2]])
+
+    def test_rotating_file_handler_compress(self):
+        basename = os.path.join(self.dirname, 'rot.log')
+        handler = logbook.RotatingFileHandler(basename, max_size=2048,
+                                              backup_count=3, compress=True)
+        handler.format_string = '{record.message}'
+        with handler:
+            for c, x in izip(string.letters, xrange(32)):
+                self.log.warn(c * 256)
+        files = [x for x in os.listdir(self.dirname)
+                 if x.startswith('rot.log')]
+        files.sort()
+
+        self.assertEqual(files, ['rot.log', 'rot.log.1.gz', 'rot.log.2.gz',
+                                 'rot.log.3.gz'])
+        for filename, first in [('rot.log.1.gz', 'v'), ('rot.log.2.gz', 'o'),
+                                ('rot.log.3.gz', 'h')]:
+            f = gzip.open(os.path.join(self.dirname, filename))
+            try:
+                self.assertEqual(f.readline().rstrip(), first * 256)
+            finally:
+                f.close()
+
+    def test_rotating_file_handler_size_tracking(self):
+        basename = os.path.join(self.dirname, 'rot.log')
+        with open(basename, 'w') as f:
+            f.write('a' * 255 + '\n')
+        handler = logbook.RotatingFileHandler(basename, max_size=1024,
+                                              backup_count=1)
+        handler.format_string = '{record.message}'
+        with handler:
+            self.log.warn('b' * 255)
+            self.assertEqual(handler._size, 512)
+            # simulate an external truncation (like logrotate's
+            # copytruncate).  The handler only finds out once the tracked
+            # size says a rollover is necessary.
+            open(basename, 'w').close()
+            for x in xrange(3):
+                self.log.warn('c' * 255)
+        self.assertFalse(os.path.exists(basename + '.1'))
+        with open(basename) as f:
+            self.assertEqual(f.read(), ('c' * 255 + '\n') * 3)
+
+    def test_rotating_file_handler_external_growth(self):
+        basename = os.path.join(self.dirname, 'rot.log')
+        handler = logbook.RotatingFileHandler(basename, max_size=1024,
+                                              backup_count=1)
+        handler.format_string = '{record.message}'
+        with handler:
+            self.log.warn('b' * 255)
+            # another writer appends to the file.  This is not accounted
+            # for until the tracked size reaches the maximum size.
+            with open(basename, 'a') as f:
+                f.write('x' * 511 + '\n')
+            self.log.warn('c' * 255)
+            self.log.warn('d' * 255)
+            self.assertFalse(os.path.exists(basename + '.1'))
+            self.log.warn('e' * 255)
+        with open(basename + '.1') as f:
+            self.assertEqual(f.read(), 'b' * 255 + '\n' + 'x' * 511 + '\n' +
+                             'c' * 255 + '\n' + 'd' * 255 + '\n')
+        with open(basename) as f:
+            self.assertEqual(f.read(), 'e' * 255 + '\n')
+
+    def test_shared_rotating_file_handler(self):
+        basename = os.path.join(self.dirname, 'shared.log')
+        self.assertRaises(ValueError, logbook.SharedRotatingFileHandler,
+                          basename, 'w')
+        handlers = [logbook.SharedRotatingFileHandler(basename, 'a',
+                        max_size=1024, backup_count=2, check_interval=0,
+                        format_string='{record.message}')
+                    for x in xrange(2)]
+        for c in 'abcd':
+            for handler in handlers:
+                handler.handle(logbook.LogRecord('Test', logbook.WARNING,
+                                                 c * 255))
+        for handler in handlers:
+            handler.close()
+        with open(basename + '.1') as f:
+            self.assertEqual(f.read(), ('a' * 255 + '\n') * 2 +
+                                       ('b' * 255 + '\n') * 2)
+        with open(basename) as f:
+            self.assertEqual(f.read(), ('c' * 255 + '\n') * 2 +
+                                       ('d' * 255 + '\n') * 2)
+        self.assertFalse(os.path.exists(basename + '.2'))
+
+    def test_shared_rotating_file_handler_processes(self):
+        from multiprocessing import Process
+        basename = os.path.join(self.dirname, 'shared.log')
+
+        def log_records(char):
+            handler = logbook.SharedRotatingFileHandler(basename,
+                max_size=4096, backup_count=100, check_interval=0,
+                format_string='{record.message}', max_record_size=101)
+            for x in xrange(200):
+                handler.handle(logbook.LogRecord('Test', logbook.WARNING,
+                                                 char * 150))
+            handler.close()
+
+        processes = [Process(target=log_records, args=(c,)) for c in 'abcd']
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+        lines = []
+        for filename in os.listdir(self.dirname):
+            if filename.startswith('shared.log') and \
+               not filename.endswith('.lock'):
+                with open(os.path.join(self.dirname, filename)) as f:
+                    lines.extend(f.readlines())
+        self.assertEqual(len(lines), 800)
+        self.assertEqual(sorted(set(lines)), [c * 100 + '\n' for c in 'abcd'])
+
     def test_timed_rotating_file_handler(self):
         basename = os.path.join(self.dirname, 'trot.log')
         handler = logbook.TimedRotatingFileHandler(basename, backup_count=3)
@@ -306,6 +612,77 @@ class HandlerTestCase(LogbookTestCase):
             self.assertEqual(f.readline().rstrip(), '[01:00] Third One')
             self.assertEqual(f.readline().rstrip(), '[02:00] Third One')
 
+    def test_timed_rotating_file_handler_retention(self):
+        basename = os.path.join(self.dirname, 'trot.log')
+        for day in xrange(1, 5):
+            filename = os.path.join(self.dirname, 'trot-2010-01-0%d.log' % day)
+            open(filename, 'w').close()
+            os.utime(filename, (day, day))
+        handler = logbook.TimedRotatingFileHandler(basename, backup_count=3,
+                                                   date_format='%Y-%m-%d-%H')
+        handler.format_string = '{record.message}'
+        listdir_calls = []
+        old_listdir = os.listdir
+        def listdir(path):
+            listdir_calls.append(path)
+            return old_listdir(path)
+
+        def fake_record(message, hour, minute):
+            lr = logbook.LogRecord('Test Logger', logbook.WARNING, message)
+            lr.time = datetime(2010, 1, 5, hour, minute)
+            return lr
+
+        os.listdir = listdir
+        try:
+            with handler:
+                for hour in xrange(3):
+                    for minute in xrange(0, 60, 15):
+                        handler.handle(fake_record('%d:%d' % (hour, minute),
+                                                   hour, minute))
+                self.assertEqual((handler._period_start, handler._period_end),
+                                 (datetime(2010, 1, 5, 2),
+                                  datetime(2010, 1, 5, 3)))
+        finally:
+            os.listdir = old_listdir
+        self.assertEqual(len(listdir_calls), 1)
+
+        files = [x for x in os.listdir(self.dirname) if x.startswith('trot')]
+        files.sort()
+        self.assertEqual(files, ['trot-2010-01-05-00.log',
+                                 'trot-2010-01-05-01.log',
+                                 'trot-2010-01-05-02.log'])
+        with open(os.path.join(self.dirname, 'trot-2010-01-05-01.log')) as f:
+            self.assertEqual(f.read(), '1:0\n1:15\n1:30\n1:45\n')
+
+    def test_timed_rotating_file_handler_compress(self):
+        basename = os.path.join(self.dirname, 'trot.log')
+        handler = logbook.TimedRotatingFileHandler(basename, backup_count=3,
+                                                   compress=True)
+        handler.format_string = '{record.message}'
+
+        def fake_record(message, day):
+            lr = logbook.LogRecord('Test Logger', logbook.WARNING, message)
+            lr.time = datetime(2010, 1, day, 12)
+            return lr
+
+        with handler:
+            for day in xrange(5, 9):
+                handler.handle(fake_record('Day %d' % day, day))
+                # make sure the files can be ordered by modification time
+                handler._maintenance.join()
+                time.sleep(0.01)
+
+        files = [x for x in os.listdir(self.dirname) if x.startswith('trot')]
+        files.sort()
+        self.assertEqual(files, ['trot-2010-01-06.log.gz',
+                                 'trot-2010-01-07.log.gz',
+                                 'trot-2010-01-08.log'])
+        f = gzip.open(os.path.join(self.dirname, 'trot-2010-01-07.log.gz'))
+        try:
+            self.assertEqual(f.read(), 'Day 7\n')
+        finally:
+            f.close()
+
     def test_mail_handler(self):
         handler = make_fake_mail_handler(subject=u'\xf8nicode')
         with capture_stderr() as fallback:
@@ -499,6 +876,34 @@ Message:
             logger.warn('Logbook is too awesome for stdlib')
             self.assertEqual(test_handler.records[0].dispatcher, logger)
 
+    def test_dispatch_records(self):
+        records = [logbook.LogRecord('App', level, 'Record %d' % idx)
+                   for idx, level in enumerate([logbook.DEBUG,
+                                                logbook.WARNING,
+                                                logbook.ERROR])]
+        stream = StringIO()
+        outer_handler = logbook.TestHandler()
+        stream_handler = logbook.StreamHandler(stream, level=logbook.WARNING,
+                                               format_string='{record.message}')
+        filtered_handler = logbook.TestHandler(bubble=True)
+        filtered_handler.filter = lambda r, h: r.level == logbook.ERROR
+        with outer_handler:
+            with stream_handler:
+                with filtered_handler:
+                    logbook.dispatch_records(records)
+        self.assertEqual(stream.getvalue(), 'Record 1\nRecord 2\n')
+        self.assertEqual(filtered_handler.formatted_records,
+                         ['[ERROR] App: Record 2'])
+        self.assertEqual(outer_handler.formatted_records,
+                         ['[DEBUG] App: Record 0'])
+
+        with outer_handler:
+            with logbook.NullHandler(level=logbook.ERROR):
+                logbook.dispatch_records(records)
+        self.assertEqual(len(outer_handler.records), 3)
+        self.assert_(outer_handler.has_warning('Record 1'))
+        self.assert_(not outer_handler.has_error('Record 2'))
+
     def test_filtering(self):
         logger1 = logbook.Logger('Logger1')
         logger2 = logbook.Logger('Logger2')
@@ -651,6 +1056,46 @@ class WarningsCompatTestCase(LogbookTestCase):
 
 class MoreTestCase(LogbookTestCase):
 
+    def test_circuit_breaker(self):
+        from logbook.more import CircuitBreakerHandler
+        class FailingHandler(logbook.TestHandler):
+            failing = True
+            attempts = 0
+            def emit(self, record):
+                self.attempts += 1
+                if self.failing:
+                    raise IOError('unavailable')
+                logbook.TestHandler.emit(self, record)
+
+        inner = FailingHandler()
+        handler = CircuitBreakerHandler(inner, failure_threshold=3,
+                                        reset_timeout=1)
+        now = [1000.0]
+        handler._time = lambda: now[0]
+        with capture_stderr() as captured:
+            with handler:
+                for x in xrange(10):
+                    self.log.warn('Record {0}', x)
+                self.assert_(handler.open)
+                self.assertEqual(inner.attempts, 3)
+                self.assertEqual(handler.dropped, 7)
+                # a failed probe keeps the circuit open for longer
+                now[0] += 1
+                self.log.warn('Probe')
+                self.assertEqual(inner.attempts, 4)
+                now[0] += 1.5
+                self.log.warn('Dropped')
+                self.assertEqual(inner.attempts, 4)
+                now[0] += 0.5
+                inner.failing = False
+                self.log.warn('Probe')
+                self.log.warn('Passed')
+                self.assert_(not handler.open)
+        self.assertEqual(inner.attempts, 6)
+        self.assert_(inner.has_warning('Passed'))
+        # only the first error was reported
+        self.assertEqual(captured.getvalue().count('IOError: unavailable'), 1)
+
     def test_fingerscrossed(self):
         from logbook.more import FingersCrossedHandler
         handler = FingersCrossedHandler(logbook.default_handler,
@@ -725,6 +1170,67 @@ class MoreTestCase(LogbookTestCase):
             '[ERROR] Test: Pure hate!'
         ])
 
+    def test_flight_recorder(self):
+        from logbook.more import FlightRecorderHandler, read_flight_recording
+        dirname = tempfile.mkdtemp()
+        filename = os.path.join(dirname, 'flight')
+        try:
+            handler = FlightRecorderHandler(filename, size=4096)
+            with handler:
+                for x in xrange(200):
+                    self.log.debug('Message {0}', x)
+                try:
+                    1/0
+                except Exception:
+                    self.log.exception(u'Division f\xe4iled')
+            handler.close()
+            records = read_flight_recording(filename)
+            self.assert_(10 < len(records) < 200)
+            last = records.pop()
+            self.assertEqual(last.message, u'Division f\xe4iled')
+            self.assertEqual(last.level_name, 'ERROR')
+            self.assertEqual(last.channel, 'testlogger')
+            self.assert_('ZeroDivisionError' in last.formatted_exception)
+            self.assertEqual(last.extra['seq'], 201)
+            self.assertEqual([r.message for r in records],
+                             ['Message %d' % x for x in
+                              xrange(200 - len(records), 200)])
+            self.assertEqual([r.extra['seq'] for r in records],
+                             range(201 - len(records), 201))
+        finally:
+            shutil.rmtree(dirname)
+
+    def test_flight_recorder_after_crash(self):
+        from multiprocessing import Process
+        from logbook.more import FlightRecorderHandler, read_flight_recording
+        dirname = tempfile.mkdtemp()
+        filename = os.path.join(dirname, 'flight')
+
+        def crash():
+            handler = FlightRecorderHandler(filename, size=1024 * 1024)
+            handler.push_application()
+            for x in xrange(50):
+                self.log.debug('Record {0}', x)
+            os._exit(1)
+
+        try:
+            p = Process(target=crash)
+            p.start()
+            p.join()
+            records = read_flight_recording(filename)
+            self.assertEqual([r.message for r in records],
+                             ['Record %d' % x for x in xrange(50)])
+            # a new handler continues the recording
+            handler = FlightRecorderHandler(filename, size=1024 * 1024)
+            with handler:
+                self.log.debug('Again')
+            handler.close()
+            records = read_flight_recording(filename)
+            self.assertEqual(len(records), 51)
+            self.assertEqual(records[-1].extra['seq'], 51)
+        finally:
+            shutil.rmtree(dirname)
+
     def test_tagged(self):
         from logbook.more import TaggingLogger, TaggingHandler
         stream = StringIO()
@@ -778,6 +1284,114 @@ class MoreTestCase(LogbookTestCase):
 
 class QueuesTestCase(LogbookTestCase):
 
+    def test_fanout_handler(self):
+        from logbook.queues import FanoutHandler
+        class SlowHandler(logbook.TestHandler):
+            def emit(self, record):
+                time.sleep(0.1)
+                logbook.TestHandler.emit(self, record)
+
+        children = [SlowHandler(bubble=True) for x in xrange(3)]
+        handler = FanoutHandler(children, wait=True)
+        start = time.time()
+        with handler:
+            self.log.error('Everywhere')
+        self.assert_(time.time() - start < 0.25)
+        for child in children:
+            self.assert_(child.has_error('Everywhere'))
+
+        error_handler = logbook.TestHandler(level='ERROR', bubble=True)
+        stopping_handler = logbook.TestHandler()
+        unreached_handler = logbook.TestHandler()
+        handler = FanoutHandler([error_handler, stopping_handler,
+                                 unreached_handler], wait=True)
+        with handler:
+            self.log.warn('A warning')
+        self.assert_(not error_handler.records)
+        self.assert_(stopping_handler.has_warning('A warning'))
+        self.assert_(not unreached_handler.records)
+
+        handler = FanoutHandler([logbook.NullHandler(), error_handler],
+                                wait=True)
+        with handler:
+            self.log.error('Swallowed')
+        self.assert_(not error_handler.records)
+
+        # the logging call does not wait longer than the timeout
+        child = SlowHandler()
+        handler = FanoutHandler([child], wait=True, timeout=0.01)
+        start = time.time()
+        with handler:
+            self.log.warn('Later')
+        self.assert_(time.time() - start < 0.09)
+        self.assert_(not child.records)
+        for x in xrange(50):
+            if child.records:
+                break
+            time.sleep(0.01)
+        self.assert_(child.has_warning('Later'))
+
+        # each child gets its records in order and one at a time
+        class JitterHandler(logbook.TestHandler):
+            def emit(self, record):
+                time.sleep(randrange(3) / 1000.0)
+                logbook.TestHandler.emit(self, record)
+        children = [JitterHandler(bubble=True) for x in xrange(2)]
+        handler = FanoutHandler(children)
+        with handler:
+            for x in xrange(20):
+                self.log.warn('Record {0}', x)
+        for x in xrange(100):
+            if all(len(child.records) == 20 for child in children):
+                break
+            time.sleep(0.01)
+        for child in children:
+            self.assertEqual([r.message for r in child.records],
+                             ['Record %d' % x for x in xrange(20)])
+
+        # records that do not fit are dropped
+        class ManualPool(object):
+            tasks = []
+            def submit(self, func, *args):
+                self.tasks.append((func, args))
+        pool = ManualPool()
+        child = logbook.TestHandler()
+        handler = FanoutHandler([child], pool=pool, max_pending=5)
+        with handler:
+            for x in xrange(10):
+                self.log.warn('Record {0}', x)
+        self.assertEqual(handler.dropped, 5)
+        self.assertEqual(len(pool.tasks), 1)
+        func, args = pool.tasks.pop()
+        func(*args)
+        self.assertEqual([r.message for r in child.records],
+                         ['Record %d' % x for x in xrange(5)])
+
+    def test_handler_pool_after_fork(self):
+        from multiprocessing import Process
+        from logbook.queues import HandlerPool
+        pool = HandlerPool(workers=1)
+        blocked = threading.Event()
+        reader, writer = os.pipe()
+        # the only thread of the pool is busy, so the second task waits
+        pool.submit(blocked.wait)
+        pool.submit(os.write, writer, 'parent ')
+        def child():
+            pool.submit(os.write, writer, 'child ')
+            time.sleep(0.1)
+            os._exit(0)
+        p = Process(target=child)
+        p.start()
+        p.join()
+        try:
+            self.assertEqual(os.read(reader, 512), 'child ')
+            blocked.set()
+            self.assertEqual(os.read(reader, 512), 'parent ')
+        finally:
+            blocked.set()
+            os.close(reader)
+            os.close(writer)
+
     def test_zeromq_handler(self):
         from logbook.queues import ZeroMQHandler, ZeroMQSubscriber
         tests = [
@@ -816,6 +1430,129 @@ class QueuesTestCase(LogbookTestCase):
         self.assert_(test_handler.has_warning('This is a warning'))
         self.assert_(test_handler.has_error('This is an error'))
 
+    def test_zeromq_batches(self):
+        from logbook.queues import ZeroMQHandler, ZeroMQSubscriber, \
+             BinaryCodec
+        import zmq
+        context = zmq.Context()
+        uri = 'inproc://logbook-batches'
+        handler = ZeroMQHandler(uri, context=context, codec=BinaryCodec(),
+                                batch_size=3, compress=True)
+        subscriber = ZeroMQSubscriber(uri, context=context)
+        # give the subscription some time to reach the publisher
+        time.sleep(0.1)
+        with handler:
+            for x in xrange(4):
+                self.log.warn('Batched {0}', x)
+        self.assertEqual(handler._batches, {None: [handler._batches[None][0]]})
+        handler.close()
+        messages = [subscriber.recv(timeout=1) for x in xrange(4)]
+        self.assertEqual([x.message for x in messages],
+                         ['Batched %d' % x for x in xrange(4)])
+        self.assertEqual(subscriber.recv(timeout=0.05), None)
+        subscriber.close()
+
+    def test_zeromq_batch_interval(self):
+        from logbook.queues import ZeroMQHandler, ZeroMQSubscriber
+        import zmq
+        context = zmq.Context()
+        uri = 'inproc://logbook-batch-interval'
+        handler = ZeroMQHandler(uri, context=context, batch_size=100,
+                                batch_interval=0.01)
+        subscriber = ZeroMQSubscriber(uri, context=context)
+        time.sleep(0.1)
+        with handler:
+            self.log.warn('Sent by the flusher')
+        record = subscriber.recv(timeout=1)
+        self.assertEqual(record.message, 'Sent by the flusher')
+        handler.close()
+        subscriber.close()
+
+    def test_zeromq_topics(self):
+        from logbook.queues import ZeroMQHandler, ZeroMQSubscriber, \
+             InterningCodec
+        import zmq
+        context = zmq.Context()
+        uri = 'inproc://logbook-topics'
+        handler = ZeroMQHandler(uri, context=context, topics=True,
+                                codec=InterningCodec())
+        everything = ZeroMQSubscriber(uri, context=context)
+        errors = ZeroMQSubscriber(uri, context=context, level='ERROR')
+        channel = ZeroMQSubscriber(uri, context=context, level='WARNING',
+                                   channels=['other'])
+        time.sleep(0.1)
+        other = logbook.Logger('other')
+        with handler:
+            self.log.info('info')
+            self.log.error('error')
+            other.warn('other warning')
+            other.debug('other debug')
+            self.log.critical('critical')
+        handler.close()
+
+        def receive(subscriber):
+            rv = []
+            while 1:
+                record = subscriber.recv(timeout=0.1)
+                if record is None:
+                    return rv
+                rv.append(record.message)
+        self.assertEqual(receive(everything), ['info', 'error',
+            'other warning', 'other debug', 'critical'])
+        self.assertEqual(receive(errors), ['error', 'critical'])
+        self.assertEqual(receive(channel), ['other warning'])
+        for subscriber in everything, errors, channel:
+            subscriber.close()
+
+    def test_zeromq_background_thread_skips_undecodable(self):
+        from logbook.queues import ZeroMQHandler, ZeroMQSubscriber, \
+             InterningCodec
+        import zmq
+        context = zmq.Context()
+        uri = 'inproc://logbook-undecodable'
+        handler = ZeroMQHandler(uri, context=context)
+        subscriber = ZeroMQSubscriber(uri, context=context)
+        test_handler = logbook.TestHandler()
+        controller = subscriber.dispatch_in_background(test_handler)
+        time.sleep(0.1)
+        # the continuation of a string table the subscriber never saw
+        codec = InterningCodec()
+        record = logbook.LogRecord('testlogger', logbook.WARNING, 'lost')
+        codec.encode(record)
+        handler.socket.send(codec.encode(record))
+        with handler:
+            self.log.warn('This is a warning')
+        for x in xrange(50):
+            if test_handler.records:
+                break
+            time.sleep(0.02)
+        controller.stop()
+        handler.close()
+        subscriber.close()
+        self.assertEqual([r.message for r in test_handler.records],
+                         ['This is a warning'])
+
+    def test_zeromq_export_record(self):
+        from logbook.queues import ZeroMQHandler, ZeroMQSubscriber
+        import zmq
+        class MyHandler(ZeroMQHandler):
+            def export_record(self, record):
+                rv = ZeroMQHandler.export_record(self, record)
+                rv['extra']['exported'] = True
+                return rv
+        context = zmq.Context()
+        uri = 'inproc://logbook-export'
+        handler = MyHandler(uri, context=context)
+        subscriber = ZeroMQSubscriber(uri, context=context)
+        time.sleep(0.1)
+        with handler:
+            self.log.warn('message')
+        handler.close()
+        record = subscriber.recv(timeout=1)
+        self.assertEqual(record.message, 'message')
+        self.assert_(record.extra['exported'])
+        subscriber.close()
+
     def test_multi_processing_handler(self):
         from multiprocessing import Process, Queue
         from logbook.queues import MultiProcessingHandler, \
@@ -836,6 +1573,410 @@ class QueuesTestCase(LogbookTestCase):
             subscriber.dispatch_once()
             self.assert_(test_handler.has_warning('Hello World'))
 
+    def test_multi_processing_handler_codec(self):
+        from multiprocessing import Process, Queue
+        from logbook.queues import MultiProcessingHandler, \
+             MultiProcessingSubscriber, BinaryCodec
+        queue = Queue(-1)
+        test_handler = logbook.TestHandler()
+        subscriber = MultiProcessingSubscriber(queue)
+
+        def send_back():
+            with MultiProcessingHandler(queue, codec=BinaryCodec()):
+                logbook.warn(u'Hello W\xf6rld')
+
+        p = Process(target=send_back)
+        p.start()
+        p.join()
+
+        with test_handler:
+            subscriber.dispatch_once()
+            self.assert_(test_handler.has_warning(u'Hello W\xf6rld'))
+
+    def test_multi_processing_subscriber_in_background(self):
+        from multiprocessing import Queue
+        from logbook.queues import MultiProcessingHandler, \
+             MultiProcessingSubscriber
+        queue = Queue(-1)
+        test_handler = logbook.TestHandler()
+        subscriber = MultiProcessingSubscriber(queue)
+        self.assert_(subscriber.fileno() is not None)
+        self.assertEqual(subscriber.recv(timeout=0), None)
+        start = time.time()
+        self.assertEqual(subscriber.recv(timeout=0.1), None)
+        self.assert_(time.time() - start >= 0.09)
+
+        controller = subscriber.dispatch_in_background(test_handler)
+        try:
+            with MultiProcessingHandler(queue):
+                logbook.warn('Hello World')
+            for x in xrange(50):
+                if test_handler.records:
+                    break
+                time.sleep(0.01)
+            self.assert_(test_handler.has_warning('Hello World'))
+        finally:
+            start = time.time()
+            controller.stop()
+            self.assert_(time.time() - start < 0.5)
+
+    def test_multi_processing_subscriber_recv_many(self):
+        from multiprocessing import Queue
+        from logbook.queues import MultiProcessingHandler, \
+             MultiProcessingSubscriber, BinaryCodec, InterningCodec
+        queue = Queue(-1)
+        test_handler = logbook.TestHandler()
+        subscriber = MultiProcessingSubscriber(queue)
+        self.assertEqual(subscriber.recv_many(timeout=0), [])
+
+        with MultiProcessingHandler(queue):
+            for x in xrange(5):
+                logbook.warn('Record {0}', x)
+        # give the feeder thread of the queue time to write everything
+        time.sleep(0.1)
+        records = subscriber.recv_many(3, timeout=1)
+        self.assertEqual([r.message for r in records],
+                         ['Record 0', 'Record 1', 'Record 2'])
+        with test_handler:
+            self.assertEqual(subscriber.dispatch_batch(timeout=1), 2)
+        self.assertEqual(test_handler.formatted_records,
+                         ['[WARNING] Generic: Record 3',
+                          '[WARNING] Generic: Record 4'])
+
+        # messages that cannot be decoded do not end the batch
+        codec = InterningCodec()
+        record = logbook.LogRecord('testlogger', logbook.WARNING, 'lost')
+        codec.encode(record)
+        queue.put(BinaryCodec().encode(record))
+        queue.put(codec.encode(record))
+        queue.put(BinaryCodec().encode(record))
+        time.sleep(0.1)
+        self.assertEqual(len(subscriber.recv_many(timeout=0)), 2)
+
+    def test_shared_memory_handler(self):
+        from logbook.queues import SharedMemoryHandler, \
+             SharedMemorySubscriber
+        dirname = tempfile.mkdtemp()
+        filename = os.path.join(dirname, 'ring')
+        subscriber = SharedMemorySubscriber(filename, size=4096)
+        handler = SharedMemoryHandler(filename)
+        try:
+            self.assertEqual(subscriber.recv(timeout=0), None)
+            with handler:
+                for x in xrange(100):
+                    logbook.warn(u'R\xf6cord {0}', x)
+                    # the ring is small, so it wraps around a few times
+                    if x % 10 == 9:
+                        records = subscriber.recv_many()
+                        self.assertEqual([r.message for r in records],
+                            [u'R\xf6cord %d' % y for y in xrange(x - 9, x + 1)])
+                for x in xrange(1000):
+                    logbook.warn('Overflow')
+            self.assert_(handler.dropped > 0)
+            self.assertEqual(len(subscriber.recv_many(1000)),
+                             1000 - handler.dropped)
+
+            def send():
+                time.sleep(0.05)
+                with handler:
+                    logbook.warn('Wake up')
+            thread = threading.Thread(target=send)
+            thread.start()
+            record = subscriber.recv(timeout=2)
+            thread.join()
+            self.assertEqual(record.message, 'Wake up')
+
+            # a forked process does not write into the ring of its parent
+            from multiprocessing import Process
+            dropped = handler.dropped
+            def child():
+                with handler:
+                    logbook.warn('From the child')
+                os._exit(handler.dropped == dropped + 1 and 42 or 1)
+            p = Process(target=child)
+            p.start()
+            p.join()
+            self.assertEqual(p.exitcode, 42)
+            self.assertEqual(subscriber.recv(timeout=0), None)
+        finally:
+            handler.close()
+            subscriber.close()
+            shutil.rmtree(dirname)
+
+    def test_socket_handler(self):
+        from logbook.queues import SocketHandler, SocketSubscriber
+        subscriber = SocketSubscriber(('127.0.0.1', 0))
+        handler = SocketHandler(subscriber.address)
+        try:
+            with handler:
+                for x in xrange(100):
+                    logbook.warn('Record {0}', x)
+            records = []
+            while len(records) < 100:
+                rv = subscriber.recv_many(timeout=2)
+                self.assert_(rv)
+                records.extend(rv)
+            self.assertEqual([r.message for r in records],
+                             ['Record %d' % x for x in xrange(100)])
+        finally:
+            handler.close()
+            subscriber.close()
+
+    def test_socket_handler_reconnect(self):
+        from logbook.queues import SocketHandler, SocketSubscriber
+        dirname = tempfile.mkdtemp()
+        address = os.path.join(dirname, 'socket')
+        # nobody listens yet, so the records are buffered
+        handler = SocketHandler(address, max_buffer=1024, max_backoff=0.05)
+        subscriber = None
+        try:
+            with handler:
+                for x in xrange(100):
+                    logbook.warn('Record {0}', x)
+            self.assert_(0 < handler.dropped < 100)
+            subscriber = SocketSubscriber(address)
+            records = []
+            while len(records) < 100 - handler.dropped:
+                rv = subscriber.recv_many(timeout=2)
+                self.assert_(rv)
+                records.extend(rv)
+            self.assertEqual(records[0].message, 'Record 0')
+        finally:
+            handler.close()
+            if subscriber is not None:
+                subscriber.close()
+            shutil.rmtree(dirname)
+
+    def test_socket_handler_partial_send(self):
+        from logbook.queues import SocketHandler, RecordDecoder, split_frames
+        import socket
+        class BrokenSocket(object):
+            # sends a few bytes at a time and breaks after `limit` bytes
+            def __init__(self, limit):
+                self.limit = limit
+                self.data = ''
+            def send(self, data):
+                if self.limit is not None and len(self.data) >= self.limit:
+                    raise socket.error('connection reset')
+                data = str(data[:7])
+                self.data += data
+                return len(data)
+            def close(self):
+                pass
+        connections = []
+        class BrokenSocketHandler(SocketHandler):
+            def _connect(self):
+                connections.append(BrokenSocket(not connections and 100
+                                                or None))
+                return connections[-1]
+
+        handler = BrokenSocketHandler(('127.0.0.1', 0))
+        with handler:
+            for x in xrange(20):
+                logbook.warn('Record {0}', x)
+        for x in xrange(100):
+            if not handler._frames:
+                break
+            time.sleep(0.02)
+        handler.close()
+        with handler:
+            logbook.warn('After closing')
+        self.assertEqual(handler.dropped, 1)
+
+        # every record arrives once and complete, the incomplete copy on
+        # the broken connection is discarded
+        self.assertEqual(len(connections), 2)
+        decoder = RecordDecoder()
+        messages = []
+        for connection in connections:
+            frames, rest = split_frames(connection.data)
+            for frame in frames:
+                messages.append(decoder.decode(frame).message)
+        self.assertEqual(messages, ['Record %d' % x for x in xrange(20)])
+
+    def test_collector(self):
+        from logbook.queues import SocketHandler
+        from logbook.collector import Collector
+        dirname = tempfile.mkdtemp()
+        test_handler = logbook.TestHandler()
+        collector = Collector([('127.0.0.1', 0),
+                               os.path.join(dirname, 'socket')],
+                              setup=test_handler, max_queued=10)
+        collector.start()
+        handlers = [SocketHandler(address) for address in collector.addresses
+                    for x in xrange(10)]
+        try:
+            for idx, handler in enumerate(handlers):
+                with handler:
+                    for x in xrange(50):
+                        logbook.warn('Handler {0} record {1}', idx, x)
+            for handler in handlers:
+                handler.close()
+            for x in xrange(200):
+                if len(test_handler.records) == 1000:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(len(test_handler.records), 1000)
+            messages = [r.message for r in test_handler.records]
+            for idx in xrange(len(handlers)):
+                mine = [m for m in messages
+                        if m.startswith('Handler %d ' % idx)]
+                self.assertEqual(mine, ['Handler %d record %d' % (idx, x)
+                                        for x in xrange(50)])
+        finally:
+            collector.stop()
+            shutil.rmtree(dirname)
+
+    def test_spooling_handler(self):
+        from logbook.queues import SpoolingHandler
+        class FlakyHandler(logbook.TestHandler):
+            down = False
+            def emit(self, record):
+                if self.down:
+                    raise IOError('down')
+                logbook.TestHandler.emit(self, record)
+
+        def wait_for(handler, count):
+            for x in xrange(200):
+                if len(handler.records) >= count and not spooler.spooling:
+                    break
+                time.sleep(0.01)
+
+        dirname = tempfile.mkdtemp()
+        spool = os.path.join(dirname, 'spool')
+        target = FlakyHandler()
+        handler = spooler = SpoolingHandler(target, spool, segment_size=100,
+                                            retry_interval=0.01)
+        try:
+            with handler:
+                self.log.warn('Record 0')
+                target.down = True
+                for x in xrange(1, 20):
+                    self.log.warn('Record {0}', x)
+                self.assert_(handler.spooling)
+                self.assert_(len(os.listdir(spool)) > 2)
+                target.down = False
+                self.log.warn('Record 20')
+                wait_for(target, 21)
+                self.log.warn('Record 21')
+            wait_for(target, 22)
+            self.assert_(not handler.spooling)
+            self.assertEqual(os.listdir(spool), [])
+            self.assertEqual(target.formatted_records,
+                             ['[WARNING] testlogger: Record %d' % x
+                              for x in xrange(22)])
+
+            # a spool that is left over is replayed on the next start
+            target.down = True
+            with handler:
+                self.log.warn('Left over')
+            handler.close()
+            target = FlakyHandler()
+            handler = spooler = SpoolingHandler(target, spool)
+            wait_for(target, 1)
+            self.assert_(target.has_warning('Left over'))
+
+            # a slow handler does not hold the lock of the spooler
+            target.blocked = threading.Event()
+            target.emit = lambda record: target.blocked.wait()
+            thread = threading.Thread(target=handler.emit,
+                args=(logbook.LogRecord('Test', logbook.WARNING, 'Slow'),))
+            thread.setDaemon(True)
+            thread.start()
+            time.sleep(0.05)
+            self.assert_(handler.lock.acquire(False))
+            handler.lock.release()
+            target.blocked.set()
+            thread.join()
+        finally:
+            handler.close()
+            shutil.rmtree(dirname)
+
+    def test_binary_codec(self):
+        from logbook.queues import BinaryCodec, JSONCodec, decode_record
+        records = []
+        class EncodingHandler(logbook.Handler):
+            def emit(self, record):
+                records.append((BinaryCodec().encode(record),
+                                BinaryCodec(fields=()).encode(record),
+                                JSONCodec().encode(record)))
+        with EncodingHandler():
+            try:
+                1/0
+            except Exception:
+                self.log.exception(u'Failed in {0}', u'\xe4', extra={'a': 1})
+        binary, projected, json_data = records[0]
+        self.assertEqual(binary[:1], BinaryCodec.tag)
+        self.assert_(len(projected) < len(binary) < len(json_data))
+
+        record = decode_record(binary)
+        self.assert_(isinstance(record, logbook.FrozenRecord))
+        from_json = decode_record(json_data)
+        for key in ('channel', 'level', 'message', 'time', 'process',
+                    'thread', 'thread_name', 'filename', 'lineno',
+                    'func_name', 'module', 'formatted_exception',
+                    'exception_name', 'exception_message', 'extra'):
+            self.assertEqual(getattr(record, key), getattr(from_json, key))
+        self.assertEqual(record.message, u'Failed in \xe4')
+        self.assertEqual(record.extra, {'a': 1})
+
+        record = decode_record(projected)
+        self.assertEqual(record.message, u'Failed in \xe4')
+        self.assertEqual(record.level, logbook.ERROR)
+        self.assertEqual(record.time, from_json.time)
+        self.assertEqual(record.filename, None)
+        self.assertEqual(record.extra, {})
+        self.assertRaises(ValueError, decode_record, 'garbage')
+
+    def test_interning_codec(self):
+        from logbook.queues import InterningCodec, BinaryCodec, RecordDecoder
+        encoded = []
+        codec = InterningCodec(reset_interval=4)
+        class EncodingHandler(logbook.Handler):
+            def emit(self, record):
+                encoded.append((codec.encode(record),
+                                BinaryCodec().encode(record)))
+        with EncodingHandler():
+            for x in xrange(12):
+                self.log.warn('Message number {0}', x)
+                self.log.info('Constant message')
+
+        # once the strings are known records are a lot smaller
+        interned, binary = encoded[-1]
+        self.assert_(len(interned) * 2 < len(binary))
+
+        decoder = RecordDecoder()
+        records = [decoder.decode(x[0]) for x in encoded]
+        self.assertEqual([r.message for r in records],
+                         [u'Message number %d' % (x // 2) if x % 2 == 0
+                          else u'Constant message' for x in xrange(24)])
+        self.assertEqual(records[-1].channel, u'testlogger')
+        self.assertEqual(records[-1].func_name, u'test_interning_codec')
+
+        # a late joiner skips records until the table starts over
+        decoder = RecordDecoder()
+        records = [decoder.decode(x[0]) for x in encoded[3:]]
+        self.assertEqual(records[0], None)
+        self.assertEqual(records[1].message, u'Message number 2')
+
+        # lost records make the decoder wait for the next table
+        decoder = RecordDecoder()
+        records = [decoder.decode(x[0]) for x in encoded[:1] + encoded[2:]]
+        self.assertEqual(records[0].message, u'Message number 0')
+        self.assertEqual(records[1:3], [None, None])
+        self.assertEqual(records[3].message, u'Message number 2')
+
+        # strings defined after a lost definition are not mixed up
+        del encoded[:]
+        codec.reset()
+        with EncodingHandler():
+            for channel in 'first', 'second', 'third', 'second':
+                logbook.Logger(channel).warn('message')
+        decoder = RecordDecoder()
+        records = [decoder.decode(x[0]) for x in encoded[:1] + encoded[2:]]
+        self.assertEqual(records[0].channel, u'first')
+        self.assertEqual(records[1:], [None, None])
+
     def test_threaded_wrapper_handler(self):
         from logbook.queues import ThreadedWrapperHandler
         test_handler = logbook.TestHandler()
@@ -851,6 +1992,86 @@ class QueuesTestCase(LogbookTestCase):
         self.assert_(test_handler.has_warning('Just testing'))
         self.assert_(test_handler.has_error('More testing'))
 
+    def test_record_queue_overflow(self):
+        from logbook.queues import RecordQueue
+        def make_record(level, msg):
+            return logbook.LogRecord('Test', level, msg)
+        def fill(queue):
+            for level, msg in [(logbook.ERROR, 'a'), (logbook.INFO, 'b'),
+                               (logbook.WARNING, 'c'), (logbook.INFO, 'd')]:
+                queue.put(make_record(level, msg), 10)
+            rv = []
+            queue.close()
+            while 1:
+                record = queue.get()
+                if record is None:
+                    return rv
+                rv.append(record.msg)
+
+        self.assertEqual(fill(RecordQueue(max_size=3,
+            overflow='drop_newest')), ['a', 'b', 'c'])
+        self.assertEqual(fill(RecordQueue(max_size=3,
+            overflow='drop_oldest')), ['b', 'c', 'd'])
+        self.assertEqual(fill(RecordQueue(max_size=3,
+            overflow='drop_lowest')), ['a', 'c', 'd'])
+        self.assertEqual(fill(RecordQueue(max_bytes=25,
+            overflow='drop_oldest')), ['c', 'd'])
+        self.assertEqual(fill(RecordQueue(prioritize=True)),
+                         ['a', 'c', 'b', 'd'])
+        queue = RecordQueue(max_size=2, overflow='block', timeout=0.01)
+        fill(queue)
+        self.assertEqual(queue.dropped, 2)
+        queue = RecordQueue(max_size=1, overflow='drop_lowest')
+        queue.put(make_record(logbook.ERROR, 'a'))
+        self.assertFalse(queue.put(make_record(logbook.INFO, 'b')))
+        self.assertEqual(queue.dropped, 1)
+        self.assertRaises(ValueError, RecordQueue, overflow='whatever')
+
+    def test_threaded_wrapper_handler_frozen_records(self):
+        from logbook.queues import ThreadedWrapperHandler
+        test_handler = logbook.TestHandler()
+        handler = ThreadedWrapperHandler(test_handler)
+        with handler:
+            self.log.warn('Hello {0}', 'World')
+        handler.close()
+        record = test_handler.records[0]
+        self.assert_(isinstance(record, logbook.FrozenRecord))
+        self.assertEqual(record.message, 'Hello World')
+        self.assertEqual(record.func_name,
+                         'test_threaded_wrapper_handler_frozen_records')
+        self.assertEqual(record.thread_name,
+                         threading.currentThread().getName())
+
+    def test_threaded_wrapper_handler_bounded(self):
+        from threading import Event
+        from logbook.queues import ThreadedWrapperHandler
+        started = Event()
+        proceed = Event()
+        class SlowHandler(logbook.TestHandler):
+            def emit(self, record):
+                started.set()
+                proceed.wait()
+                logbook.TestHandler.emit(self, record)
+
+        test_handler = SlowHandler()
+        handler = ThreadedWrapperHandler(test_handler, max_size=2,
+                                         overflow='drop_lowest',
+                                         prioritize=True)
+        self.assertEqual(handler.level, logbook.NOTSET)
+        handler.level = logbook.INFO
+        self.assertEqual(test_handler.level, logbook.INFO)
+        with handler:
+            self.log.info('First')
+            started.wait()
+            self.log.info('Dropped')
+            self.log.warn('Warning')
+            self.log.error('Error')
+            proceed.set()
+        handler.close()
+        self.assertEqual(handler.dropped_records, 1)
+        self.assertEqual([x.message for x in test_handler.records],
+                         ['First', 'Error', 'Warning'])
+
     def test_execnet_handler(self):
         def run_on_remote(channel):
             import logbook
@@ -884,6 +2105,105 @@ class QueuesTestCase(LogbookTestCase):
                 record = subscribers.recv()
                 self.assertEqual(record.message, test)
 
+    def test_subscriber_group_polling(self):
+        from Queue import Queue
+        from logbook.queues import SharedMemoryHandler, \
+             SharedMemorySubscriber, SubscriberBase, SubscriberGroup
+        class QueueSubscriber(SubscriberBase):
+            def __init__(self):
+                self.queue = Queue()
+            def recv(self, timeout=None):
+                try:
+                    return self.queue.get(timeout=timeout)
+                except Exception:
+                    return None
+
+        dirname = tempfile.mkdtemp()
+        filenames = [os.path.join(dirname, 'ring%d' % x) for x in xrange(20)]
+        ring_subscribers = [SharedMemorySubscriber(filename, size=4096)
+                            for filename in filenames]
+        queue_subscriber = QueueSubscriber()
+        threads = threading.activeCount()
+        group = SubscriberGroup(ring_subscribers + [queue_subscriber])
+        try:
+            # only the subscriber without a file descriptor has a thread
+            self.assertEqual(threading.activeCount(), threads + 1)
+            self.assertEqual(group.recv(timeout=0.05), None)
+            handlers = [SharedMemoryHandler(filename)
+                        for filename in filenames]
+            for idx, handler in enumerate(handlers):
+                with handler:
+                    self.log.warn('Ring {0}', idx)
+                handler.close()
+            queue_subscriber.queue.put(logbook.LogRecord('Test',
+                logbook.WARNING, 'Queue'))
+            messages = set()
+            while len(messages) < 21:
+                records = group.recv_many(timeout=2)
+                self.assert_(records)
+                messages.update(r.message for r in records)
+            self.assertEqual(messages, set(['Ring %d' % x for x in xrange(20)]
+                                           + ['Queue']))
+
+            # stopping closes the wakeup pipe of the group
+            wakeup = group._wakeup
+            group.stop()
+            for fd in wakeup:
+                self.assertRaises(OSError, os.fstat, fd)
+            self.assertEqual(group.recv(timeout=0.05), None)
+        finally:
+            group.stop()
+            for subscriber in ring_subscribers:
+                subscriber.close()
+            shutil.rmtree(dirname)
+
+    def test_subscriber_group_ordered(self):
+        from datetime import datetime, timedelta
+        from logbook.queues import SharedMemoryHandler, \
+             SharedMemorySubscriber, SubscriberGroup, get_source_id
+        dirname = tempfile.mkdtemp()
+        filenames = [os.path.join(dirname, 'ring%d' % x) for x in xrange(3)]
+        subscribers = [SharedMemorySubscriber(filename, size=4096)
+                       for filename in filenames]
+        group = SubscriberGroup(subscribers, ordered=True,
+                                reorder_window=0.2)
+        handlers = [SharedMemoryHandler(filename) for filename in filenames]
+        try:
+            now = datetime.utcnow()
+            for offset, idx in [(3, 0), (1, 1), (2, 2), (0, 2), (4, 1)]:
+                record = logbook.LogRecord('Test', logbook.WARNING,
+                                           'Record %d' % offset)
+                record.time = now + timedelta(milliseconds=offset)
+                handlers[idx].handle(record)
+                # only the sent copy is stamped
+                self.assert_('_logbook_seq' not in record.extra)
+            record = logbook.LogRecord('Test', logbook.WARNING, 'Tie')
+            record.time = now
+            record.extra['seq'] = 'not a stamp'
+            handlers[0].handle(record)
+
+            # nothing comes out before the reorder window passed
+            self.assertEqual(group.recv_many(timeout=0), [])
+            records = []
+            while len(records) < 6:
+                rv = group.recv_many(timeout=2)
+                self.assert_(rv)
+                records.extend(rv)
+            self.assertEqual([r.message for r in records],
+                             ['Record 0', 'Tie', 'Record 1', 'Record 2',
+                              'Record 3', 'Record 4'])
+            seqs = [r.extra['_logbook_seq'] for r in records]
+            self.assert_(seqs[0] < seqs[1])
+            self.assertEqual(set(r.extra['_logbook_source'] for r in records),
+                             set([get_source_id()]))
+            self.assertEqual(records[1].extra['seq'], 'not a stamp')
+        finally:
+            group.stop()
+            for handler, subscriber in zip(handlers, subscribers):
+                handler.close()
+                subscriber.close()
+            shutil.rmtree(dirname)
+
 
 class TicketingTestCase(LogbookTestCase):
 